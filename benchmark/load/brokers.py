@@ -0,0 +1,196 @@
+# Copyright (c) 2022 Nemanja Vasiljevic <xvasil03@gmail.com>.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Lightweight local stand-ins of destinations used by load benchmark. Every
+# stand-in records time when notification was received and can inject
+# latency and faults.
+
+import json
+import random
+import time
+
+import eventlet
+import eventlet.wsgi
+
+from enoss.destinations.idestination import IDestination
+
+
+class Faults(object):
+    def __init__(self, latency=0, fault_rate=0):
+        # seconds added to every request and probability of failure
+        self.latency = latency
+        self.fault_rate = fault_rate
+
+    def delay(self):
+        if self.latency:
+            eventlet.sleep(self.latency)
+
+    def should_fail(self):
+        return self.fault_rate and random.random() < self.fault_rate
+
+
+class Recorder(object):
+    def __init__(self):
+        # (receive time, notification), parsed after benchmark
+        self.received = []
+        self.failed = 0
+
+    def record(self, notification):
+        self.received.append((time.time(), notification))
+
+
+class _NullLog(object):
+    def write(self, *args):
+        pass
+
+
+class BeanstalkdServer(object):
+    # subset of beanstalkd protocol used by ENOSS (use, put, list-tube-used)
+    def __init__(self, faults=None):
+        self.faults = faults or Faults()
+        self.recorder = Recorder()
+        self.jobs = 0
+        self.sock = eventlet.listen(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+        self._server = eventlet.spawn(self._serve)
+
+    def _serve(self):
+        while True:
+            connection, _ = self.sock.accept()
+            eventlet.spawn_n(self._handle, connection)
+
+    def _handle(self, connection):
+        reader = connection.makefile("rb")
+        tube = b"default"
+        try:
+            while True:
+                line = reader.readline()
+                if not line:
+                    return
+                parts = line.split()
+                command = parts[0] if parts else b""
+                if command == b"use":
+                    tube = parts[1]
+                    connection.sendall(b"USING " + tube + b"\r\n")
+                elif command == b"list-tube-used":
+                    connection.sendall(b"USING " + tube + b"\r\n")
+                elif command == b"put":
+                    body = reader.read(int(parts[4]) + 2)[:-2]
+                    self.faults.delay()
+                    if self.faults.should_fail():
+                        self.recorder.failed += 1
+                        connection.sendall(b"OUT_OF_MEMORY\r\n")
+                        continue
+                    self.recorder.record(body)
+                    self.jobs += 1
+                    connection.sendall(b"INSERTED %d\r\n" % self.jobs)
+                else:
+                    connection.sendall(b"UNKNOWN_COMMAND\r\n")
+        except (IOError, OSError):
+            pass
+        finally:
+            connection.close()
+
+    def stop(self):
+        self._server.kill()
+        self.sock.close()
+
+
+class ElasticsearchServer(object):
+    # HTTP endpoint accepting ping, index creation, index and bulk requests
+    def __init__(self, faults=None):
+        self.faults = faults or Faults()
+        self.recorder = Recorder()
+        self.indices = set()
+        self.sock = eventlet.listen(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+        self._server = eventlet.spawn(
+            eventlet.wsgi.server, self.sock, self._app, log=_NullLog(),
+            log_output=False)
+
+    def _respond(self, start_response, status, body=None):
+        body = json.dumps(body).encode() if body is not None else b""
+        start_response(status, [
+            ("Content-Type", "application/json"),
+            ("Content-Length", str(len(body))),
+            ("X-Elastic-Product", "Elasticsearch")])
+        return [body]
+
+    def _bulk(self, body, start_response):
+        lines = [line for line in body.split(b"\n") if line]
+        items = []
+        # every document follows its action line
+        for document in lines[1::2]:
+            if self.faults.should_fail():
+                self.recorder.failed += 1
+                items.append({"index": {"status": 429, "error": {
+                    "type": "es_rejected_execution_exception"}}})
+            else:
+                self.recorder.record(document)
+                items.append({"index": {"status": 201}})
+        errors = any(item["index"]["status"] != 201 for item in items)
+        return self._respond(start_response, "200 OK",
+                             {"errors": errors, "took": 1, "items": items})
+
+    def _app(self, environ, start_response):
+        method = environ["REQUEST_METHOD"]
+        path = [part for part in environ["PATH_INFO"].split("/") if part]
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+        body = environ["wsgi.input"].read(length) if length else b""
+        if not path:
+            return self._respond(start_response, "200 OK", {
+                "version": {"number": "8.0.0"}, "tagline": "stand-in"})
+        if len(path) == 1 and method == "HEAD":
+            status = "200 OK" if path[0] in self.indices \
+                else "404 Not Found"
+            return self._respond(start_response, status)
+        if len(path) == 1 and method == "PUT":
+            self.indices.add(path[0])
+            return self._respond(start_response, "200 OK",
+                                 {"acknowledged": True, "index": path[0]})
+        self.faults.delay()
+        if path[-1] == "_bulk":
+            return self._bulk(body, start_response)
+        if path[-1] == "_doc":
+            if self.faults.should_fail():
+                self.recorder.failed += 1
+                return self._respond(start_response,
+                                     "503 Service Unavailable",
+                                     {"error": "unavailable", "status": 503})
+            self.recorder.record(body)
+            return self._respond(start_response, "201 Created",
+                                 {"result": "created"})
+        return self._respond(start_response, "400 Bad Request",
+                             {"error": "unsupported", "status": 400})
+
+    def stop(self):
+        self._server.kill()
+        self.sock.close()
+
+
+class SinkDestination(IDestination):
+    # in-process destination, replaces broker client in middleware
+    faults = Faults()
+    recorder = Recorder()
+
+    def __init__(self, conf, logger=None):
+        pass
+
+    def send_notification(self, notification, event):
+        self.faults.delay()
+        if self.faults.should_fail():
+            self.recorder.failed += 1
+            raise Exception("injected sink fault")
+        self.recorder.record(notification)
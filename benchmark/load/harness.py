@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# Copyright (c) 2022 Nemanja Vasiljevic <xvasil03@gmail.com>.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Drives ENOSS (on top of FakeSwift) served by eventlet.wsgi with concurrent
+# PUT/GET/DELETE traffic and reports throughput, latency and delivery lag
+# of notifications received by local stand-ins of destinations.
+
+from __future__ import print_function
+
+import eventlet
+eventlet.monkey_patch()
+
+import argparse  # noqa: E402
+import http.client  # noqa: E402
+import json  # noqa: E402
+import os  # noqa: E402
+import sys  # noqa: E402
+import tempfile  # noqa: E402
+import time  # noqa: E402
+
+import eventlet.wsgi  # noqa: E402
+from swift.common.swob import HTTPCreated, HTTPNoContent, HTTPOk  # noqa
+from swift.common.utils import get_logger  # noqa: E402
+from test.unit.common.middleware.helpers import FakeSwift  # noqa: E402
+
+import enoss.destinations as destinations_module  # noqa: E402
+from enoss.enoss import ENOSSMiddleware  # noqa: E402
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from brokers import BeanstalkdServer, ElasticsearchServer, Faults, \
+    SinkDestination  # noqa: E402
+
+_repo_dir = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+# destination name used in notification configuration
+destination_names = {
+    "beanstalkd": "Beanstalkd",
+    "elasticsearch": "Elasticsearch",
+    # in-process sink replaces kafka client
+    "sink": "Kafka",
+}
+methods = ("PUT", "GET", "DELETE")
+object_body = b"x" * 1024
+
+
+class _NullLog(object):
+    def write(self, *args):
+        pass
+
+
+class InfocacheMiddleware(object):
+    # account/container info is served from memcache in real proxy
+    def __init__(self, app, notification_conf):
+        self.app = app
+        self.notification_conf = notification_conf
+
+    def __call__(self, environ, start_response):
+        environ["swift.infocache"] = {
+            "account/a": {"sysmeta": {}},
+            "container/a/c": {
+                "sysmeta": {"notifications": self.notification_conf}},
+        }
+        return self.app(environ, start_response)
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+
+    def percentile(p):
+        return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+    return {
+        "p50_ms": percentile(50) * 1000,
+        "p90_ms": percentile(90) * 1000,
+        "p99_ms": percentile(99) * 1000,
+        "max_ms": values[-1] * 1000,
+    }
+
+
+def start_brokers(args, faults):
+    brokers = {}
+    sections = []
+    if "beanstalkd" in args.destinations:
+        brokers["beanstalkd"] = BeanstalkdServer(faults)
+        sections.append("[beanstalkd]\naddr = 127.0.0.1\nport = {}\n"
+                        "tube = enoss\n".format(brokers["beanstalkd"].port))
+    if "elasticsearch" in args.destinations:
+        brokers["elasticsearch"] = ElasticsearchServer(faults)
+        sections.append(
+            "[elasticsearch]\nhosts = http://127.0.0.1:{}\nindex = enoss\n"
+            "auth_user = enoss\nauth_passwd = enoss\n"
+            "bulk = {}\n".format(brokers["elasticsearch"].port,
+                                 "true" if args.es_bulk else "false"))
+    if "sink" in args.destinations:
+        SinkDestination.faults = faults
+        brokers["sink"] = SinkDestination
+        sections.append("[kafka]\n")
+    return brokers, "\n".join(sections)
+
+
+def create_app(args, destinations_conf_path, objects):
+    fake_swift = FakeSwift(capture_unexpected_calls=False)
+    headers = {"Content-Type": "application/octet-stream",
+               "Content-Length": str(len(object_body)), "Etag": "etag"}
+    for i in range(objects):
+        path = "/v1/a/c/o{}".format(i)
+        fake_swift.register("PUT", path, HTTPCreated,
+                            {"Etag": "etag", "Content-Length": "0"}, b"")
+        fake_swift.register("GET", path, HTTPOk, headers, object_body)
+        fake_swift.register("HEAD", path, HTTPOk, headers)
+        fake_swift.register("DELETE", path, HTTPNoContent, {})
+    conf = {
+        "use_destinations": ",".join(
+            destination_names[name].lower() for name in args.destinations),
+        "destinations_conf_path": destinations_conf_path,
+        "s3_schema": os.path.join(_repo_dir, "etc", "swift", "enoss",
+                                  "configuration-schema.json"),
+    }
+    conf.update(args.conf)
+    logger = get_logger({"log_level": "ERROR"}, log_route="enoss-load")
+    original = destinations_module.KafkaDestination
+    destinations_module.KafkaDestination = SinkDestination
+    try:
+        enoss = ENOSSMiddleware(fake_swift, conf, logger=logger)
+    finally:
+        destinations_module.KafkaDestination = original
+    notification_conf = json.dumps({
+        "{}Configrations".format(destination_names[name]): [
+            {"Id": "load", "Events": ["*"]}]
+        for name in args.destinations})
+    return fake_swift, enoss, InfocacheMiddleware(enoss, notification_conf)
+
+
+def client(port, objects, results):
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    for i in objects:
+        for method in methods:
+            start = time.time()
+            connection.request(method, "/v1/a/c/o{}".format(i),
+                               body=object_body if method == "PUT" else None)
+            resp = connection.getresponse()
+            resp.read()
+            results.append((method, "o{}".format(i), start, time.time(),
+                            resp.status))
+    connection.close()
+
+
+def wait_for_delivery(brokers, expected, timeout):
+    # async dispatch, bulk indexing or replay deliver after response
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if all(len(broker.recorder.received) + broker.recorder.failed
+               >= expected for broker in brokers.values()):
+            return
+        eventlet.sleep(0.1)
+
+
+def get_lags(recorder, request_starts):
+    lags = []
+    for received_at, notification in recorder.received:
+        try:
+            record = json.loads(notification)["Records"][0]
+        except (ValueError, KeyError, IndexError, TypeError):
+            continue
+        method = record["eventName"].rsplit(":", 1)[-1].upper()
+        start = request_starts.get(
+            (method, record["s3"]["object"]["key"]))
+        if start is not None:
+            lags.append(received_at - start)
+    return lags
+
+
+def run(args):
+    faults = Faults(args.latency / 1000.0, args.fault_rate)
+    brokers, destinations_conf = start_brokers(args, faults)
+    fd, destinations_conf_path = tempfile.mkstemp()
+    with os.fdopen(fd, "w") as f:
+        f.write(destinations_conf)
+    try:
+        fake_swift, enoss, app = create_app(args, destinations_conf_path,
+                                            args.objects)
+    finally:
+        os.unlink(destinations_conf_path)
+
+    sock = eventlet.listen(("127.0.0.1", 0))
+    server = eventlet.spawn(eventlet.wsgi.server, sock, app, log=_NullLog(),
+                            log_output=False)
+    results = []
+    pool = eventlet.GreenPool(args.concurrency)
+    start = time.time()
+    for n in range(args.concurrency):
+        pool.spawn(client, sock.getsockname()[1],
+                   range(n, args.objects, args.concurrency), results)
+    pool.waitall()
+    duration = time.time() - start
+    wait_for_delivery(brokers, len(results), args.drain_timeout)
+
+    request_starts = {(method, key): started
+                      for method, key, started, _, _ in results}
+    report = {
+        "requests": len(results),
+        "concurrency": args.concurrency,
+        "duration_s": duration,
+        "throughput_rps": len(results) / duration if duration else 0,
+        "errors": sum(1 for result in results if result[4] >= 500),
+        "latency": percentiles([end - started for _, _, started, end, _
+                                in results]),
+        "latency_by_method": {
+            method: percentiles([end - started for m, _, started, end, _
+                                 in results if m == method])
+            for method in methods},
+        "destinations": {},
+        "enoss": enoss.get_stats(),
+    }
+    for name, broker in brokers.items():
+        report["destinations"][name] = {
+            "received": len(broker.recorder.received),
+            "rejected": broker.recorder.failed,
+            "missing": len(results) - len(broker.recorder.received),
+            "lag": percentiles(get_lags(broker.recorder, request_starts)),
+        }
+    server.kill()
+    sock.close()
+    for broker in brokers.values():
+        if hasattr(broker, "stop"):
+            broker.stop()
+    return report
+
+
+def parse_conf(values):
+    conf = {}
+    for value in values:
+        key, _, option = value.partition("=")
+        conf[key.strip()] = option.strip()
+    return conf
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Load benchmark of ENOSS with local destinations")
+    parser.add_argument("--destinations", default="beanstalkd",
+                        help="comma separated: {}".format(
+                            ", ".join(sorted(destination_names))))
+    parser.add_argument("--objects", type=int, default=1000,
+                        help="objects, each one is PUT, GET and DELETEd")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0,
+                        help="latency (ms) injected into destinations")
+    parser.add_argument("--fault-rate", type=float, default=0,
+                        help="probability of destination failure")
+    parser.add_argument("--es-bulk", action="store_true",
+                        help="use bulk mode of elasticsearch destination")
+    parser.add_argument("--conf", action="append", default=[],
+                        metavar="OPTION=VALUE",
+                        help="ENOSS option, e.g. async_dispatch=true")
+    parser.add_argument("--drain-timeout", type=float, default=10,
+                        help="seconds to wait for delayed notifications")
+    parser.add_argument("--output", help="write JSON report to file")
+    args = parser.parse_args(argv)
+    args.destinations = [name.strip() for name
+                         in args.destinations.split(",") if name.strip()]
+    unknown = set(args.destinations) - set(destination_names)
+    if unknown:
+        parser.error("unknown destinations: {}".format(
+            ", ".join(sorted(unknown))))
+    args.conf = parse_conf(args.conf)
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run(args)
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
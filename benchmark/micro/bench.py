@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# Copyright (c) 2022 Nemanja Vasiljevic <xvasil03@gmail.com>.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Measures overhead which ENOSS adds to single request, using FakeSwift
+# from swift unit tests instead of real cluster and no-op destination.
+
+from __future__ import print_function
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import timeit
+
+from swift.common.swob import HTTPCreated, HTTPNoContent, HTTPOk, Request
+from swift.common.utils import get_logger
+from test.unit.common.middleware.helpers import FakeSwift
+
+import enoss.destinations as destinations_module
+import enoss.payloads as payloads_module
+import enoss.serializers as serializers_module
+from enoss.destinations.idestination import IDestination
+from enoss.enoss import ENOSSMiddleware
+from enoss.utils import get_payload_handlers, get_serializer_handlers
+
+_repo_dir = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+default_baseline = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "baseline.json")
+
+object_path = "/v1/a/c/photo.jpg"
+object_body = b"x" * 1024
+
+rules = {
+    "none": None,
+    "key": [{"Name": "prefix", "Value": "photo"},
+            {"Name": "suffix", "Value": ".jpg"}],
+    "size": [{"Name": "minsize", "Value": 1},
+             {"Name": "maxsize", "Value": 1048576}],
+    "contenttype": [{"Name": "contenttype", "Value": "image/jpeg"}],
+}
+methods = ("PUT", "GET", "DELETE")
+
+
+class NoopDestination(IDestination):
+    def __init__(self, conf, logger=None):
+        self.sent = 0
+
+    def send_notification(self, notification, event):
+        self.sent += 1
+
+
+def get_payload_names():
+    return sorted(name[:-len("Payload")].lower() for name
+                  in get_payload_handlers([payloads_module]))
+
+
+def get_serializer_names():
+    return sorted(name[:-len("Serializer")].lower() for name
+                  in get_serializer_handlers([serializers_module]))
+
+
+def create_fake_swift():
+    fake_swift = FakeSwift()
+    headers = {"Content-Type": "image/jpeg", "Content-Length": "1024",
+               "Etag": "etag", "X-Timestamp": "1650000000.00000"}
+    fake_swift.register("PUT", object_path, HTTPCreated, headers)
+    fake_swift.register("GET", object_path, HTTPOk, headers, object_body)
+    fake_swift.register("HEAD", object_path, HTTPOk, headers)
+    fake_swift.register("DELETE", object_path, HTTPNoContent, {})
+    return fake_swift
+
+
+def create_notification_conf(configurations, rule, payload):
+    destination_configurations = []
+    for i in range(configurations):
+        configuration = {
+            "Id": "conf-{}".format(i),
+            "Events": ["*"],
+            "PayloadStructure": payload,
+        }
+        if rules[rule]:
+            configuration["Filter"] = {"Key": {"FilterRules": rules[rule]}}
+        destination_configurations.append(configuration)
+    return json.dumps({"BeanstalkdConfigrations": destination_configurations})
+
+
+def create_middleware(fake_swift, destinations_conf_path):
+    conf = {
+        "use_destinations": "beanstalkd",
+        "destinations_conf_path": destinations_conf_path,
+        "s3_schema": os.path.join(_repo_dir, "etc", "swift", "enoss",
+                                  "configuration-schema.json"),
+    }
+    logger = get_logger({"log_level": "ERROR"}, log_route="enoss-bench")
+    original = destinations_module.BeanstalkdDestination
+    destinations_module.BeanstalkdDestination = NoopDestination
+    try:
+        return ENOSSMiddleware(fake_swift, conf, logger=logger)
+    finally:
+        destinations_module.BeanstalkdDestination = original
+
+
+def create_request(method, notification_conf):
+    # account/container info is cached like in memcache of proxy
+    infocache = {
+        "account/a": {"sysmeta": {}},
+        "container/a/c": {"sysmeta": {"notifications": notification_conf}},
+    }
+    environ = {"REQUEST_METHOD": method, "swift.infocache": infocache}
+    headers = {}
+    body = None
+    if method == "PUT":
+        headers["Content-Type"] = "image/jpeg"
+        body = object_body
+    return Request.blank(object_path, environ=environ, headers=headers,
+                         body=body)
+
+
+def measure(app, fake_swift, method, notification_conf, requests, repeat):
+    def run():
+        for _ in range(requests):
+            create_request(method, notification_conf).get_response(app)
+        fake_swift.clear_calls()
+    run()
+    # the fastest run is the least disturbed one
+    best = min(timeit.repeat(run, number=1, repeat=repeat))
+    return best / requests * 1000000
+
+
+def run_benchmarks(args):
+    fd, destinations_conf_path = tempfile.mkstemp()
+    with os.fdopen(fd, "w") as f:
+        f.write("[beanstalkd]\n")
+    try:
+        results = {}
+        baseline_us = {}
+        for method in methods:
+            fake_swift = create_fake_swift()
+            baseline_us[method] = measure(fake_swift, fake_swift, method, "",
+                                          args.requests, args.repeat)
+        for configurations, rule, method, payload, serializer in \
+                itertools.product(args.configurations, args.rules, methods,
+                                  args.payloads, args.serializers):
+            with open(destinations_conf_path, "w") as f:
+                f.write("[beanstalkd]\nserializer = {}\n".format(serializer))
+            fake_swift = create_fake_swift()
+            app = create_middleware(fake_swift, destinations_conf_path)
+            notification_conf = create_notification_conf(
+                configurations, rule, payload)
+            us_per_request = measure(app, fake_swift, method,
+                                     notification_conf, args.requests,
+                                     args.repeat)
+            name = "{}-{}-{}conf-{}-{}".format(
+                method, rule, configurations, payload, serializer)
+            results[name] = {
+                "us_per_request": round(us_per_request, 2),
+                "overhead_us": round(us_per_request - baseline_us[method], 2),
+            }
+            if not args.quiet:
+                print("{:<40} {:>10.2f} us {:>10.2f} us overhead".format(
+                    name, us_per_request,
+                    us_per_request - baseline_us[method]))
+    finally:
+        os.unlink(destinations_conf_path)
+    return {
+        "python": platform.python_version(),
+        "requests": args.requests,
+        "repeat": args.repeat,
+        "no_enoss_us": {method: round(us, 2)
+                        for method, us in baseline_us.items()},
+        "results": results,
+    }
+
+
+def compare(results, baseline, tolerance, slack_us):
+    # returns scenarios whose overhead grew more than tolerance
+    regressions = []
+    for name, result in sorted(results["results"].items()):
+        expected = baseline["results"].get(name)
+        if expected is None:
+            continue
+        limit = expected["overhead_us"] * (1 + tolerance) + slack_us
+        if result["overhead_us"] > limit:
+            regressions.append((name, expected["overhead_us"],
+                                result["overhead_us"]))
+    return regressions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Microbenchmarks of ENOSS middleware overhead")
+    parser.add_argument("--requests", type=int, default=200,
+                        help="requests per measurement")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="measurements per scenario, fastest is used")
+    parser.add_argument("--configurations", default="1,10,50",
+                        help="comma separated numbers of configurations")
+    parser.add_argument("--rules", default=",".join(sorted(rules)),
+                        help="comma separated rule sets: {}".format(
+                            ", ".join(sorted(rules))))
+    parser.add_argument("--payloads", default=",".join(get_payload_names()))
+    parser.add_argument("--serializers", default="json")
+    parser.add_argument("--output", help="write JSON results to file")
+    parser.add_argument("--baseline",
+                        help="compare results with this baseline")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store results as new baseline (--baseline or "
+                             "baseline.json next to this script)")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed relative growth of overhead")
+    parser.add_argument("--slack", type=float, default=5,
+                        help="allowed absolute growth of overhead (us)")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args(argv)
+    args.configurations = [int(n) for n in args.configurations.split(",")]
+    args.rules = args.rules.split(",")
+    args.payloads = args.payloads.split(",")
+    args.serializers = args.serializers.split(",")
+    unknown = set(args.serializers) - set(get_serializer_names())
+    if unknown:
+        parser.error("unavailable serializers: {}".format(
+            ", ".join(sorted(unknown))))
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run_benchmarks(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.save_baseline:
+        with open(args.baseline or default_baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        return 0
+    if not args.baseline:
+        # baseline depends on machine, it is compared only when given
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance, args.slack)
+    for name, expected, measured in regressions:
+        print("REGRESSION {}: {:.2f} us => {:.2f} us".format(
+            name, expected, measured))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+# Copyright (c) 2022 Nemanja Vasiljevic <xvasil03@gmail.com>.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import deque
+import time
+
+from swift.common.utils import config_true_value
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class CircuitBreaker(object):
+    # stops sending to destination after failure_threshold consecutive
+    # failures or when at least failure_rate of (at least min_calls) sends
+    # in last window seconds failed; after reset_timeout seconds probes
+    # are let through and first successful one closes the circuit again
+    def __init__(self, name, failure_threshold=5, failure_rate=0.5,
+                 window=60, min_calls=20, reset_timeout=30, probes=1,
+                 logger=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.failure_rate = failure_rate
+        self.window = window
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.probes = probes
+        self.logger = logger
+        self.rejected = 0
+        self._close()
+
+    def _close(self):
+        self.state = "closed"
+        self.consecutive_failures = 0
+        # (time, failed) of sends in window
+        self.calls = deque()
+        self.window_failures = 0
+        self.opened_at = None
+        self.probes_sent = 0
+
+    def _open(self):
+        if self.logger:
+            self.logger.warning("circuit breaker of {} opened".format(
+                self.name))
+        self.state = "open"
+        self.opened_at = time.time()
+        self.probes_sent = 0
+
+    def allow(self):
+        if self.state == "open":
+            if time.time() - self.opened_at < self.reset_timeout:
+                self.rejected += 1
+                return False
+            self.state = "half_open"
+        if self.state == "half_open":
+            if self.probes_sent >= self.probes:
+                self.rejected += 1
+                return False
+            self.probes_sent += 1
+        return True
+
+    def record_cancelled(self):
+        # send was interrupted from outside (e.g. by notification budget),
+        # it says nothing about destination, probe can be sent again
+        if self.state == "half_open" and self.probes_sent:
+            self.probes_sent -= 1
+
+    def _record(self, failed):
+        now = time.time()
+        self.calls.append((now, failed))
+        self.window_failures += failed
+        while self.calls and self.calls[0][0] < now - self.window:
+            _, old_failed = self.calls.popleft()
+            self.window_failures -= old_failed
+
+    def record_success(self):
+        if self.state == "half_open":
+            if self.logger:
+                self.logger.info("circuit breaker of {} closed".format(
+                    self.name))
+            self._close()
+            return
+        self.consecutive_failures = 0
+        self._record(False)
+
+    def record_failure(self):
+        if self.state == "half_open":
+            self._open()
+            return
+        if self.state == "open":
+            return
+        self.consecutive_failures += 1
+        self._record(True)
+        if self.failure_threshold and \
+                self.consecutive_failures >= self.failure_threshold:
+            self._open()
+        elif self.failure_rate and len(self.calls) >= self.min_calls and \
+                self.window_failures >= self.failure_rate * len(self.calls):
+            self._open()
+
+
+def get_circuit_breaker(name, conf, logger=None):
+    # thresholds are set in destination section of destinations.conf
+    if not config_true_value(conf.get("circuit_breaker", False)):
+        return None
+    return CircuitBreaker(
+        name,
+        failure_threshold=int(conf.get("breaker_failure_threshold", 5)),
+        failure_rate=float(conf.get("breaker_failure_rate", 0.5)),
+        window=float(conf.get("breaker_window", 60)),
+        min_calls=int(conf.get("breaker_min_calls", 20)),
+        reset_timeout=float(conf.get("breaker_reset_timeout", 30)),
+        probes=int(conf.get("breaker_probes", 1)),
+        logger=logger)
@@ -18,9 +18,8 @@ from __future__ import absolute_import
 import json
 import jsonschema
 
-from swift.common.utils import split_path
 from enoss.utils import (
-    get_s3_event_name, get_rule_handlers, get_rule_handler_name,
+    get_rule_handlers, get_rule_handler_name, get_s3_event_mask,
     get_destination_handler_name, get_payload_handler_name, json_object_hook)
 from enoss.constants import supported_s3_events
 import enoss.filter_rules as filter_rules_module
@@ -95,75 +94,212 @@ class S3ConfigurationValidator(object):
         self.validate_payload_structure(payload_handlers, config_json)
 
 
+def _compile_rules(rules):
+    # single predicate evaluating rules from the cheapest one, result of
+    # every rule is computed once per event, also across configurations
+    rules = tuple((rule.memo_key or rule, rule) for rule
+                  in sorted(rules, key=lambda rule: rule.cost))
+    if not rules:
+        return lambda event: True
+
+    def predicate(event):
+        results = event.rule_results
+        for memo_key, rule in rules:
+            result = results.get(memo_key)
+            if result is None:
+                result = results[memo_key] = bool(rule(event))
+                rule.evaluations += 1
+                rule.matches += result
+            if not result:
+                return False
+        return True
+    return predicate
+
+
+class KeyFilterIndex(object):
+    # prefix trie and reversed suffix trie of prefix/suffix rules of all
+    # filters, filter matches key once all its indexed rules were hit
+    def __init__(self):
+        self.prefixes = {}
+        self.suffixes = {}
+        # number of indexed rules of each filter
+        self.rules_count = {}
+
+    def _add(self, trie, value, filter_id):
+        node = trie
+        for char in value:
+            node = node.setdefault(char, {})
+        # None can not collide with characters of key
+        node.setdefault(None, []).append(filter_id)
+
+    def add(self, filter_id, rules):
+        for rule in rules:
+            if rule.key_index == "prefix":
+                self._add(self.prefixes, rule.value, filter_id)
+            else:
+                self._add(self.suffixes, rule.value[::-1], filter_id)
+        self.rules_count[filter_id] = len(rules)
+
+    def _hit(self, trie, chars, hits):
+        node = trie
+        for filter_id in node.get(None, ()):
+            hits[filter_id] = hits.get(filter_id, 0) + 1
+        for char in chars:
+            node = node.get(char)
+            if node is None:
+                return
+            for filter_id in node.get(None, ()):
+                hits[filter_id] = hits.get(filter_id, 0) + 1
+
+    def match(self, key):
+        # ids of filters whose prefix/suffix rules are satisfied by key
+        if not key or not self.rules_count:
+            return frozenset()
+        hits = {}
+        self._hit(self.prefixes, key, hits)
+        self._hit(self.suffixes, reversed(key), hits)
+        return frozenset(filter_id for filter_id, count in hits.items()
+                         if count == self.rules_count[filter_id])
+
+
 class S3NotifiationConfiguration(object):
 
     class DestinationConfiguration(object):
 
         class FilterConfiguration(object):
-            def __init__(self, key, config):
+            def __init__(self, key, config, interned_rules=None):
                 self.key = key
                 self.config = config
-                self.rules = []
+                # identical rules of configurations share one instance
+                interned_rules = {} if interned_rules is None \
+                    else interned_rules
+                rules = []
                 for rule in config["FilterRules"]:
                     rule_handler_name = get_rule_handler_name(rule["Name"])
-                    rule_handler = filter_rule_handlers[rule_handler_name]
-                    self.rules.append(rule_handler(rule["Value"]))
+                    rule_key = (rule_handler_name,
+                                json.dumps(rule["Value"], sort_keys=True))
+                    if rule_key not in interned_rules:
+                        rule_handler = filter_rule_handlers[rule_handler_name]
+                        interned_rules[rule_key] = rule_handler(rule["Value"])
+                        interned_rules[rule_key].memo_key = rule_key
+                    rules.append(interned_rules[rule_key])
+                # compiled configurations are shared between requests
+                self.rules = tuple(rules)
+                self.key_rules = tuple(rule for rule in rules
+                                       if rule.key_index)
+                self.other_rules = tuple(rule for rule in rules
+                                         if not rule.key_index)
+                self._predicate = _compile_rules(self.rules)
+                self._other_predicate = _compile_rules(self.other_rules)
+                # set once filter is added to KeyFilterIndex
+                self.index_id = None
 
-            def does_satisfy(self, app, resp):
-                return all(rule(app, resp) for rule in self.rules)
+            def does_satisfy(self, event, matched_filters=None):
+                if self.index_id is None or matched_filters is None:
+                    return self._predicate(event)
+                # prefix/suffix rules were matched by index
+                return self.index_id in matched_filters \
+                    and self._other_predicate(event)
 
-        def __init__(self, config):
+        def __init__(self, config, interned_rules=None):
             self.config = config
             self.id = config["Id"]
             self.allowed_events = config["Events"]
+            self.event_mask = get_s3_event_mask(self.allowed_events)
             self.payload_type = config.get("PayloadStructure", "s3")
+            # set by payload handler once configuration is compiled
+            self.payload_template = None
             self.only_succ_events = config.get("OnlySuccessfulEvents", True)
             filer_configs = config.get("Filter", {})
-            self.filters = [self.FilterConfiguration(filter_key, filter_config)
-                            for filter_key, filter_config
-                            in filer_configs.items()]
-
-        def is_allowed_event(self, resp):
-            version, account, container, object = split_path(
-                resp.environ['PATH_INFO'], 1, 4, rest_with_last=True)
-            method = resp.environ.get('swift.orig_req_method',
-                                      resp.request.method)
-            event = get_s3_event_name(account, container, object, method)
-            for allowed_event in self.allowed_events:
-                if allowed_event.endswith("*"):
-                    if event.startswith(allowed_event[:-1]):
-                        return True
-                else:
-                    if allowed_event == event:
-                        return True
-            return False
+            self.filters = tuple(
+                self.FilterConfiguration(filter_key, filter_config,
+                                         interned_rules)
+                for filter_key, filter_config in filer_configs.items())
+            self.needs_metadata = any(rule.needs_metadata
+                                      for filter in self.filters
+                                      for rule in filter.rules)
 
-        def is_satisfied_rule(self, app, resp):
-            return not self.filters or any(filter.does_satisfy(app, resp)
-                                           for filter in self.filters)
+        def is_allowed_event(self, event):
+            return bool(self.event_mask & event.bit)
+
+        def is_satisfied_rule(self, event, matched_filters=None):
+            if not self.filters:
+                return True
+            for filter in self.filters:
+                if filter.does_satisfy(event, matched_filters):
+                    return True
+            return False
 
-        def does_satisfy(self, app, resp):
-            return self.is_allowed_event(resp) \
-                and self.is_satisfied_rule(app, resp) \
-                and (resp.is_success or not self.only_succ_events)
+        def does_satisfy(self, event, matched_filters=None):
+            # cheap checks first, rules can read metadata
+            return bool(self.event_mask & event.bit) \
+                and (event.is_success or not self.only_succ_events) \
+                and self.is_satisfied_rule(event, matched_filters)
 
     def __init__(self, config):
         self.config = config if type(config) == dict \
             else json.loads(config, object_hook=json_object_hook)
         self.destinations_configurations = {}
+        # union of events subscribed by any destination configuration
+        self.event_mask = 0
+        self.key_index = KeyFilterIndex()
+        # (rule handler name, value) => rule
+        self.interned_rules = {}
+        # (dest_name, destination configuration) in configuration order
+        self._dest_confs = []
+        # index_id => position of destination configuration owning filter
+        self._filter_owners = []
+        # positions of destination configurations not found by index,
+        # they are always evaluated
+        self._unindexed = []
         for dest_confs_name, dest_confs in self.config.items():
             for dest_conf in dest_confs:
                 # <dest_name>Configrations => <dest_name>
                 dest_name = _remove_suffix(
                     dest_confs_name, "Configrations").lower()
-                new_dest_conf = self.DestinationConfiguration(dest_conf)
+                new_dest_conf = self.DestinationConfiguration(
+                    dest_conf, self.interned_rules)
+                position = len(self._dest_confs)
+                self._dest_confs.append((dest_name, new_dest_conf))
+                if not new_dest_conf.filters:
+                    self._unindexed.append(position)
+                for filter in new_dest_conf.filters:
+                    if filter.key_rules:
+                        filter.index_id = len(self._filter_owners)
+                        self._filter_owners.append(position)
+                        self.key_index.add(filter.index_id, filter.key_rules)
+                    elif not self._unindexed \
+                            or self._unindexed[-1] != position:
+                        self._unindexed.append(position)
+                self.event_mask |= new_dest_conf.event_mask
                 self.destinations_configurations.setdefault(dest_name, [])\
                                                 .append(new_dest_conf)
 
-    def get_satisfied_destinations(self, app, resp):
+    def get_rule_stats(self):
+        # prefix/suffix rules are matched by key index, they are never
+        # evaluated one by one
+        return [{"rule": rule_name, "value": value,
+                 "evaluations": rule.evaluations, "matches": rule.matches}
+                for (rule_name, value), rule
+                in sorted(self.interned_rules.items())
+                if not rule.key_index]
+
+    def is_subscribed(self, event):
+        return bool(self.event_mask & event.bit)
+
+    def get_satisfied_destinations(self, event):
         result = {}
-        for dest_name, dest_confs in self.destinations_configurations.items():
-            for dest_conf in dest_confs:
-                if dest_conf.does_satisfy(app, resp):
-                    result.setdefault(dest_name, []).append(dest_conf)
+        if not self.is_subscribed(event):
+            return result
+        # prefix/suffix rules of all filters are matched at once, only
+        # configurations with matched filter (or filter which is not
+        # indexed) are evaluated
+        matched_filters = self.key_index.match(event.key)
+        candidates = set(self._unindexed)
+        candidates.update(self._filter_owners[filter_id]
+                          for filter_id in matched_filters)
+        for position in sorted(candidates):
+            dest_name, dest_conf = self._dest_confs[position]
+            if dest_conf.does_satisfy(event, matched_filters):
+                result.setdefault(dest_name, []).append(dest_conf)
         return result
@@ -50,3 +50,10 @@ supported_s3_events = {
     "s3:AccountAccessed:Head",
     "s3:AccountAccessed:Get",
 }
+
+# events which can occur (i.e. without wildcards), each has its own bit
+# so subscription to a list of events can be compiled into a single mask
+concrete_s3_events = sorted(event for event in supported_s3_events
+                            if not event.endswith("*"))
+
+s3_event_bits = {event: 1 << i for i, event in enumerate(concrete_s3_events)}
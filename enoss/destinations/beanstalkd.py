@@ -15,31 +15,205 @@
 
 from enoss.destinations.idestination import IDestination
 
-import json
+from collections import deque
+import eventlet
+from eventlet.semaphore import Semaphore
+import os
 import sys
+import time
 
 IS_PY2 = sys.version_info[0] < 3
 
 if IS_PY2:
     from beanstalk.serverconn import ServerConn
+    # errors reported by server, connection can still be used
+    _server_errors = ()
+    # errors of server which is temporarily unable to accept jobs
+    _transient_server_errors = ()
 else:
-    from greenstalk import Client
+    # _parse_response and Client._sock/_reader used by pipelined puts are
+    # not public, greenstalk version is pinned in requirements.txt
+    from greenstalk import Client, BeanstalkdError, DEFAULT_PRIORITY, \
+        DEFAULT_DELAY, DEFAULT_TTR, DrainingError, InternalError, \
+        OutOfMemoryError, _parse_response
+    _server_errors = (BeanstalkdError,)
+    _transient_server_errors = (DrainingError, InternalError,
+                                OutOfMemoryError)
+
+
+class BeanstalkdConnectionPool(object):
+    def __init__(self, connect, size, health_check_interval):
+        self.connect = connect
+        self.size = size
+        self.health_check_interval = health_check_interval
+        self._pid = None
+        self._reset()
+
+    def _reset(self):
+        # connections of parent process can not be shared with workers
+        self._pid = os.getpid()
+        self.free = deque()
+        self.semaphore = Semaphore(self.size)
+
+    def _is_healthy(self, connection):
+        try:
+            if IS_PY2:
+                connection.list_tube_used()
+            else:
+                connection.using()
+            return True
+        except Exception:
+            return False
+
+    def get(self):
+        if self._pid != os.getpid():
+            self._reset()
+        # waits while all connections are used by other greenthreads
+        self.semaphore.acquire()
+        try:
+            while self.free:
+                connection, last_used = self.free.pop()
+                if time.time() - last_used < self.health_check_interval \
+                        or self._is_healthy(connection):
+                    return connection
+                self.close(connection)
+            return self.connect()
+        except BaseException:
+            # including timeouts of caller
+            self.semaphore.release()
+            raise
+
+    def put(self, connection):
+        # broken connection is closed by caller and returned as None
+        if connection is not None:
+            self.free.append((connection, time.time()))
+        self.semaphore.release()
+
+    def close(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close_all(self):
+        while self.free:
+            connection, _ = self.free.pop()
+            self.close(connection)
+
 
 class BeanstalkdDestination(IDestination):
-    def __init__(self, conf):
+    def __init__(self, conf, logger=None):
         self.conf = conf["beanstalkd"]
+        self.logger = logger
         self.tube = self.conf.get("tube", "default")
+        self.max_retries = int(self.conf.get("max_retries", 3))
+        self.reconnect_backoff = float(
+            self.conf.get("reconnect_backoff", 0.1))
+        self.max_reconnect_backoff = float(
+            self.conf.get("max_reconnect_backoff", 5))
+        self.pool = BeanstalkdConnectionPool(
+            self._connect,
+            int(self.conf.get("pool_size", 8)),
+            float(self.conf.get("health_check_interval", 30)))
+
+    def _connect(self):
         if IS_PY2:
-          self.connection = ServerConn(
-            self.conf["addr"], int(self.conf["port"]))
+            connection = ServerConn(
+                self.conf["addr"], int(self.conf["port"]))
         else:
-            self.connection = Client(
-              (self.conf["addr"], int(self.conf["port"])))
-        self.connection.use(self.tube)
+            connection = Client(
+                (self.conf["addr"], int(self.conf["port"])))
+        # tube is used per connection
+        connection.use(self.tube)
+        return connection
 
     def __del__(self):
-        if self.connection:
-            self.connection.close()
+        pool = getattr(self, "pool", None)
+        if pool:
+            pool.close_all()
+
+    def _backoff(self, attempt):
+        eventlet.sleep(min(self.reconnect_backoff * 2 ** attempt,
+                           self.max_reconnect_backoff))
+
+    def send_notification(self, notification, event):
+        attempt = 0
+        while True:
+            connection = None
+            try:
+                connection = self.pool.get()
+                connection.put(notification)
+            except _server_errors:
+                if connection is not None:
+                    self.pool.put(connection)
+                raise
+            except Exception as e:
+                if connection is not None:
+                    # connection is broken (e.g. beanstalkd restarted)
+                    self.pool.close(connection)
+                    self.pool.put(None)
+                if attempt >= self.max_retries:
+                    raise
+                if self.logger:
+                    self.logger.warning("beanstalkd connection failed, "
+                                        "reconnecting: {}".format(e))
+                self._backoff(attempt)
+                attempt += 1
+            except BaseException:
+                # interrupted by timeout, state of connection is unknown
+                if connection is not None:
+                    self.pool.close(connection)
+                    self.pool.put(None)
+                raise
+            else:
+                self.pool.put(connection)
+                return
+
+    def is_retryable(self, error):
+        if isinstance(error, _server_errors):
+            # e.g. JOB_TOO_BIG would be rejected again
+            return isinstance(error, _transient_server_errors)
+        return super(BeanstalkdDestination, self).is_retryable(error)
+
+    def _pipeline_put(self, connection, notifications):
+        # all put commands are written at once, then responses are read
+        # and yielded one by one (greenstalk has no pipelining, so its
+        # socket is used directly)
+        connection._sock.sendall(b"".join(
+            b"put %d %d %d %d\r\n%b\r\n" % (
+                DEFAULT_PRIORITY, DEFAULT_DELAY, DEFAULT_TTR,
+                len(notification), notification)
+            for notification, _ in notifications))
+        for _ in notifications:
+            line = connection._reader.readline()
+            try:
+                _parse_response(line, b"INSERTED")
+                yield None
+            except BeanstalkdError as e:
+                yield e
 
-    def send_notification(self, notification):
-        self.connection.put(json.dumps(notification))
+    def send_notifications(self, notifications, errors=None):
+        if IS_PY2 or len(notifications) == 1:
+            return super(BeanstalkdDestination, self).send_notifications(
+                notifications, errors)
+        if errors is None:
+            errors = [None] * len(notifications)
+        connection = None
+        done = 0
+        try:
+            connection = self.pool.get()
+            for error in self._pipeline_put(connection, notifications):
+                errors[done] = error
+                done += 1
+        except BaseException as e:
+            # it is unknown which of remaining jobs were inserted
+            if connection is not None:
+                self.pool.close(connection)
+                self.pool.put(None)
+            if not isinstance(e, Exception):
+                raise
+            for i in range(done, len(notifications)):
+                errors[i] = e
+            return errors
+        self.pool.put(connection)
+        return errors
@@ -15,17 +15,64 @@
 
 from enoss.destinations.idestination import IDestination
 
-from elasticsearch import Elasticsearch
+import atexit
+from collections import deque
+from elasticsearch import ApiError, ConnectionError, ConnectionTimeout, \
+    Elasticsearch
+import eventlet
+from eventlet.event import Event
 import json
+import os
+
+from swift.common.utils import config_true_value
+
+# every document of bulk request is indexed into target index
+_bulk_index_action = b'{"index":{}}'
+
+
+class BulkIndexError(Exception):
+    # document of bulk request was not indexed
+    def __init__(self, status, error):
+        super(BulkIndexError, self).__init__(
+            "elasticsearch failed to index notification ({}): {}".format(
+                status, error))
+        self.status = status
+
+
+class BulkNotSent(Exception):
+    # document was removed from bulk buffer before it was sent
+    pass
 
 
 class ElasticsearchDestination(IDestination):
-    def __init__(self, conf):
+    requires_json = True
+
+    def __init__(self, conf, logger=None):
         self.conf = conf["elasticsearch"]
+        self.logger = logger
         self.target_index = self.conf["index"]
+        self.bulk = config_true_value(self.conf.get("bulk", False))
+        # results of bulk requests are reported through callbacks
+        self.buffered = self.bulk
+        self.bulk_max_docs = int(self.conf.get("bulk_max_docs", 500))
+        self.bulk_max_bytes = int(self.conf.get("bulk_max_bytes", 5242880))
+        self.bulk_flush_interval = float(
+            self.conf.get("bulk_flush_interval", 1))
+        self.bulk_buffer_size = int(self.conf.get("bulk_buffer_size", 10000))
+        self.bulk_max_retries = int(self.conf.get("bulk_max_retries", 3))
+        # documents waiting for bulk request: (document, attempts)
+        self.buffer = deque()
+        self.buffer_bytes = 0
+        self.dropped = 0
+        self.failed = 0
+        self._flusher = None
+        self._flusher_pid = None
+        # sent when batch is full, so flusher does not wait for interval
+        self._flush_needed = None
         self.es = Elasticsearch(
             self.conf["hosts"],
-            ca_certs=self.conf["ca_certs"],
+            # not needed for plain http (e.g. local testing)
+            ca_certs=self.conf.get("ca_certs") or None,
             basic_auth=(self.conf["auth_user"], self.conf["auth_passwd"])
         )
         assert (self.es.ping()), "Cannot connect to elasticsearch"
@@ -45,8 +92,147 @@ class ElasticsearchDestination(IDestination):
                 mapping = json.loads(f.read())
         return mapping
 
-    def send_notification(self, notification):
-        self.es.index(
-            index=self.target_index,
-            body=json.dumps(notification)
-        )
+    def _log_error(self, msg):
+        if self.logger:
+            self.logger.error(msg)
+
+    def _ensure_flusher(self):
+        # flusher greenthread must belong to current proxy worker
+        if self._flusher_pid != os.getpid():
+            self._flusher_pid = os.getpid()
+            self._flush_needed = Event()
+            self._flusher = eventlet.spawn(self._flush_periodically)
+            atexit.register(self.close)
+
+    def _wait_for_flush(self):
+        with eventlet.Timeout(self.bulk_flush_interval, False):
+            self._flush_needed.wait()
+        self._flush_needed = Event()
+
+    def _flush_periodically(self):
+        while True:
+            self._wait_for_flush()
+            try:
+                while self.buffer:
+                    if not self.flush():
+                        break
+            except Exception as e:
+                # flusher must keep running for the life of the worker
+                self._log_error("elasticsearch bulk flush failed: {}".format(
+                    e))
+
+    def close(self):
+        # buffered documents are sent (or handed over to be spooled)
+        # before worker exits
+        while self.buffer:
+            if not self.flush():
+                break
+        while self.buffer:
+            document, _ = self.buffer.popleft()
+            self.buffer_bytes -= len(document)
+            self._failed(document, BulkNotSent(
+                "elasticsearch bulk buffer was closed"))
+
+    def _drop(self, document):
+        self.dropped += 1
+        self._failed(document, BulkNotSent(
+            "elasticsearch bulk buffer is full"))
+
+    def _buffer(self, document, attempts, front=False):
+        if len(self.buffer) >= self.bulk_buffer_size:
+            if front:
+                # re-queued document is older than buffered ones
+                self._drop(document)
+                return
+            # buffer is full, oldest document is removed
+            old_document, _ = self.buffer.popleft()
+            self.buffer_bytes -= len(old_document)
+            self._drop(old_document)
+        if front:
+            self.buffer.appendleft((document, attempts))
+        else:
+            self.buffer.append((document, attempts))
+        self.buffer_bytes += len(document)
+
+    @staticmethod
+    def _is_retryable_status(status):
+        # rejected (e.g. overloaded cluster), not invalid document
+        return status == 429 or status >= 500
+
+    def is_retryable(self, error):
+        if isinstance(error, BulkNotSent):
+            return True
+        if isinstance(error, BulkIndexError):
+            return self._is_retryable_status(error.status)
+        if isinstance(error, (ConnectionError, ConnectionTimeout)):
+            return True
+        if isinstance(error, ApiError):
+            return self._is_retryable_status(error.status_code)
+        return super(ElasticsearchDestination, self).is_retryable(error)
+
+    def _retry(self, document, attempts, error, front=False):
+        # only documents which can be accepted later are retried, others
+        # are handed over to be spooled or dropped
+        if self.is_retryable(error) and attempts < self.bulk_max_retries:
+            self._buffer(document, attempts + 1, front)
+        else:
+            self.failed += 1
+            self._failed(document, error)
+
+    def flush(self):
+        batch = []
+        batch_bytes = 0
+        while self.buffer and len(batch) < self.bulk_max_docs \
+                and batch_bytes < self.bulk_max_bytes:
+            document, attempts = self.buffer.popleft()
+            batch.append((document, attempts))
+            batch_bytes += len(document)
+        self.buffer_bytes -= batch_bytes
+        if not batch:
+            return True
+        operations = []
+        for document, _ in batch:
+            operations.append(_bulk_index_action)
+            operations.append(document)
+        try:
+            resp = self.es.bulk(index=self.target_index,
+                                operations=operations)
+        except BaseException as e:
+            if not isinstance(e, Exception):
+                # interrupted (e.g. by timeout), batch is sent again later
+                for document, attempts in reversed(batch):
+                    self.buffer.appendleft((document, attempts))
+                self.buffer_bytes += batch_bytes
+                raise
+            # whole request failed, documents are kept for next flush
+            self._log_error("elasticsearch bulk request failed: {}".format(e))
+            for document, attempts in reversed(batch):
+                self._retry(document, attempts, e, front=True)
+            return False
+        delivered = len(batch)
+        if resp.get("errors"):
+            # retry only documents which were not indexed
+            for (document, attempts), item in zip(batch, resp["items"]):
+                result = item.get("index", {})
+                if result.get("error"):
+                    delivered -= 1
+                    self._retry(document, attempts, BulkIndexError(
+                        result.get("status", 500), result["error"]))
+        if delivered:
+            self._delivered(delivered)
+        return True
+
+    def send_notification(self, notification, event):
+        if not self.bulk:
+            self.es.index(
+                index=self.target_index,
+                body=notification
+            )
+            return
+        self._ensure_flusher()
+        self._buffer(notification, 0)
+        # bulk request is sent by flusher, never on request path
+        if (len(self.buffer) >= self.bulk_max_docs
+                or self.buffer_bytes >= self.bulk_max_bytes) \
+                and not self._flush_needed.ready():
+            self._flush_needed.send()
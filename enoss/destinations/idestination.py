@@ -19,10 +19,58 @@ import six
 
 @six.add_metaclass(abc.ABCMeta)
 class IDestination(object):
+    # destinations which only buffer notification in send_notification
+    # (e.g. for bulk requests) report its result later through callbacks
+    buffered = False
+    # destinations which store notification as JSON document (e.g.
+    # elasticsearch) can not use serializer producing other format
+    requires_json = False
+    _on_delivered = None
+    _on_failed = None
+
     @abc.abstractmethod
-    def __init__(self, conf):
+    def __init__(self, conf, logger=None):
         raise NotImplementedError('__init__ is not implemented')
 
+    # notification is already encoded payload (bytes), event provides at
+    # least account, container and object (EventContext, EventSummary of
+    # asynchronously dispatched notification) or is None (spool replay)
     @abc.abstractmethod
-    def send_notification(self, notification):
+    def send_notification(self, notification, event):
         raise NotImplementedError('send_notification is not implemented')
+
+    def set_delivery_callbacks(self, on_delivered, on_failed):
+        # on_delivered(count) and on_failed(notification, error) are
+        # called with results of buffered notifications
+        self._on_delivered = on_delivered
+        self._on_failed = on_failed
+
+    def _delivered(self, count):
+        if self._on_delivered:
+            self._on_delivered(count)
+
+    def _failed(self, notification, error):
+        if self._on_failed:
+            self._on_failed(notification, error)
+
+    def is_retryable(self, error):
+        # whether notification which failed with error can be sent later
+        # (e.g. destination was unreachable), permanent errors (e.g. too
+        # big notification) are not spooled
+        return isinstance(error, EnvironmentError)
+
+    def send_notifications(self, notifications, errors=None):
+        # notifications is list of (notification, event), returns list with
+        # exception (or None if sent) for each notification; destinations
+        # can override it to send whole batch at once. Result of each
+        # notification is stored to errors as soon as it is known, so
+        # caller interrupted by timeout knows which ones were sent
+        if errors is None:
+            errors = [None] * len(notifications)
+        for i, (notification, event) in enumerate(notifications):
+            try:
+                self.send_notification(notification, event)
+                errors[i] = None
+            except Exception as e:
+                errors[i] = e
+        return errors
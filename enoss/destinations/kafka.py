@@ -15,15 +15,30 @@
 
 from __future__ import absolute_import
 
+import functools
+
 from enoss.destinations.idestination import IDestination
 
-import json
 from kafka import KafkaProducer
+from kafka.errors import KafkaError
+
+from swift.common.utils import config_true_value
+
+partition_keys = ("none", "account", "container", "object")
 
 
 class KafkaDestination(IDestination):
-    def __init__(self, conf):
+    # producer sends messages in background, results are reported by
+    # callbacks of its futures
+    buffered = True
+
+    def __init__(self, conf, logger=None):
         self.conf = conf["kafka"]
+        self.logger = logger
+        self.partition_key = self.conf.get("partition_key", "none")
+        if self.partition_key not in partition_keys:
+            raise ValueError("Unsupported kafka partition key {}".format(
+                self.partition_key))
         conn_conf = self._get_conn_conf()
         self.conn = KafkaProducer(**conn_conf)
         self.topic = self.conf["topic"]
@@ -33,11 +48,55 @@ class KafkaDestination(IDestination):
         conn_conf = {key[len(conn_prefix):]:value \
             for key, value in self.conf.items() \
             if key.startswith(conn_prefix)}
+        # producer options with first-class support (converted to proper
+        # types), they override raw conn_ options
+        if "compression_type" in self.conf:
+            conn_conf["compression_type"] = self.conf["compression_type"]
+        for option in ("linger_ms", "batch_size"):
+            if option in self.conf:
+                conn_conf[option] = int(self.conf[option])
+        if "acks" in self.conf:
+            acks = self.conf["acks"]
+            conn_conf["acks"] = acks if acks == "all" else int(acks)
+        if "enable_idempotence" in self.conf:
+            conn_conf["enable_idempotence"] = config_true_value(
+                self.conf["enable_idempotence"])
         return conn_conf
 
     def __del__(self):
-        self.conn.flush()
-        self.conn.close()
+        # producer is not created if configuration is invalid
+        conn = getattr(self, "conn", None)
+        if conn:
+            conn.flush()
+            conn.close()
+
+    def _get_key(self, event):
+        # messages with the same key end in the same partition, so order
+        # of notifications regarding one object/container is kept
+        if self.partition_key == "none" or event is None:
+            return None
+        parts = [event.account]
+        if self.partition_key in ("container", "object"):
+            parts.append(event.container)
+        if self.partition_key == "object":
+            parts.append(event.object)
+        return "/".join(part for part in parts if part).encode("utf-8")
+
+    def _on_delivery(self, record_metadata):
+        self._delivered(1)
+
+    def _on_delivery_error(self, notification, error):
+        self._failed(notification, error)
+
+    def is_retryable(self, error):
+        if isinstance(error, KafkaError):
+            # e.g. full producer buffer, but not too large message
+            return error.retriable
+        return super(KafkaDestination, self).is_retryable(error)
 
-    def send_notification(self, notification):
-        self.conn.send(self.topic, json.dumps(notification).encode())
+    def send_notification(self, notification, event):
+        future = self.conn.send(self.topic, notification,
+                                key=self._get_key(event))
+        future.add_callback(self._on_delivery)
+        future.add_errback(
+            functools.partial(self._on_delivery_error, notification))
@@ -0,0 +1,102 @@
+# Copyright (c) 2022 Nemanja Vasiljevic <xvasil03@gmail.com>.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+import eventlet
+from eventlet.queue import LightQueue, Full, Empty
+
+overflow_policies = ("block", "drop_oldest", "drop_newest")
+
+
+class NotificationDispatcher(object):
+    def __init__(self, deliver, queue_size=1024, workers=8,
+                 overflow_policy="drop_newest", batch_size=64, overflow=None,
+                 logger=None):
+        if overflow_policy not in overflow_policies:
+            raise ValueError("Unsupported overflow policy {}".format(
+                overflow_policy))
+        self.deliver = deliver
+        self.queue_size = queue_size
+        self.workers = workers
+        self.overflow_policy = overflow_policy
+        self.batch_size = batch_size
+        # called with dropped notification
+        self.overflow = overflow
+        self.logger = logger
+        self.dropped = 0
+        self.queue = None
+        self.pool = None
+        self._pid = None
+
+    def _ensure_started(self):
+        # proxy workers are forked after the middleware is loaded,
+        # so queue and greenthreads must belong to the current process
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self.queue = LightQueue(self.queue_size)
+        self.pool = eventlet.GreenPool(self.workers)
+        for _ in range(self.workers):
+            self.pool.spawn_n(self._run)
+
+    def _get_batches(self):
+        # waits for first notification, then takes already queued ones
+        batches = {}
+        handler_name, notification, event = self.queue.get()
+        batches[handler_name] = [(notification, event)]
+        for _ in range(self.batch_size - 1):
+            try:
+                handler_name, notification, event = self.queue.get_nowait()
+            except Empty:
+                break
+            batches.setdefault(handler_name, []).append((notification, event))
+        return batches
+
+    def _run(self):
+        while True:
+            for handler_name, notifications in self._get_batches().items():
+                try:
+                    self.deliver(handler_name, notifications)
+                except Exception as e:
+                    if self.logger:
+                        self.logger.error(
+                            "error during dispatching notification to {}: "
+                            "{}".format(handler_name, e))
+
+    def qsize(self):
+        return self.queue.qsize() if self.queue else 0
+
+    def put(self, handler_name, notification, event):
+        self._ensure_started()
+        item = (handler_name, notification, event)
+        if self.overflow_policy == "block":
+            self.queue.put(item)
+            return True
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except Full:
+            self.dropped += 1
+            dropped_item = item
+            if self.overflow_policy == "drop_oldest":
+                try:
+                    dropped_item = self.queue.get_nowait()
+                except Empty:
+                    dropped_item = None
+                self.queue.put_nowait(item)
+            if self.overflow and dropped_item:
+                self.overflow(*dropped_item)
+            return False
@@ -16,38 +16,68 @@
 from __future__ import absolute_import
 
 from swift.common.swob import wsgify, HTTPForbidden, HTTPBadRequest, \
-    HTTPServerError
-from swift.common.utils import split_path, get_logger
+    HTTPServerError, HTTPConflict, HTTPMethodNotAllowed, Response
+from swift.common.utils import get_logger, config_true_value, \
+    streq_const_time
+from swift.common.constraints import valid_api_version
+from swift.common.http import is_success
 from swift.common.request_helpers import get_sys_meta_prefix
-from swift.proxy.controllers.base import get_container_info, get_account_info,\
-    get_object_info, get_info
+from swift.proxy.controllers.base import get_container_info, get_account_info
 from swift.common.wsgi import WSGIContext
 
 import enoss.destinations as destinations_module
 import enoss.payloads as payloads_module
+import enoss.serializers as serializers_module
 
+from enoss.breaker import CircuitOpen, get_circuit_breaker
+from enoss.cache import LRUCache
 from enoss.configuration import (
     ConfigurationInvalid, S3ConfigurationValidator, S3NotifiationConfiguration)
+from enoss.dispatcher import NotificationDispatcher
+from enoss.event import EventContext
+from enoss.metrics import Metrics
+from enoss.spool import Spool, SpoolFull, SpoolReplayer
+from enoss.timeouts import BudgetExceeded, NotificationBudget, SendTimeout
 from enoss.utils import (
     get_payload_handlers, get_destination_handlers, get_payload_handler_name,
-    get_destination_handler_name, json_object_hook)
+    get_destination_handler_name, get_serializer_handlers,
+    get_serializer_handler_name, json_object_hook)
+import cProfile
+import eventlet
+import functools
 import json
 import os
+import pstats
+import time
+import six
 from six.moves.configparser import ConfigParser
 
 
+# result of batched notification which is not known yet
+_pending = object()
+
+# longest profile which can be requested from stats endpoint
+max_profile_seconds = 10
+
+
 class ENOSSMiddleware(WSGIContext):
     def __init__(self, app, conf, logger=None):
         self.app = app
         self.conf = conf
         self.logger = logger or get_logger(conf,
                                            log_route='eventnotifications')
+        self.metrics = Metrics(self.logger)
         self.configuration_validator = S3ConfigurationValidator(
             self.conf["s3_schema"])
         self._load_destinations_conf()
         self._load_destination_handlers()
         self._load_payload_handlers()
+        self._load_configuration_cache()
         self._load_admin_s3_conf()
+        self._load_spool()
+        self._load_dispatcher()
+        self._load_budget()
+        self._load_stats()
         super(ENOSSMiddleware, self).__init__(app)
 
     def _load_destinations_conf(self):
@@ -60,7 +90,11 @@ class ENOSSMiddleware(WSGIContext):
 
     def _load_destination_handlers(self):
         self.destination_handlers = {}
+        self.destination_serializers = {}
+        self.circuit_breakers = {}
+        self.send_timeouts = {}
         dest_handlers = get_destination_handlers([destinations_module])
+        serializer_handlers = get_serializer_handlers([serializers_module])
         use_dests = []
         for dest in self.conf["use_destinations"].split(","):
             dest = dest.strip()
@@ -73,8 +107,31 @@ class ENOSSMiddleware(WSGIContext):
             handler_name = get_destination_handler_name(dest_name)
             handler = dest_handlers[handler_name]
             self.destination_handlers[handler_name] = handler(
-                self.destinations_conf
+                self.destinations_conf, logger=self.logger
             )
+            self.destination_handlers[handler_name].set_delivery_callbacks(
+                functools.partial(self._on_buffered_delivered, handler_name),
+                functools.partial(self._on_buffered_failed, handler_name))
+            dest_conf = self.destinations_conf.get(dest_name, {})
+            breaker = get_circuit_breaker(handler_name, dest_conf,
+                                          logger=self.logger)
+            if breaker:
+                self.circuit_breakers[handler_name] = breaker
+            send_timeout = float(dest_conf.get("send_timeout", 0))
+            if send_timeout > 0:
+                self.send_timeouts[handler_name] = send_timeout
+            serializer_name = dest_conf.get("serializer", "json")
+            serializer = serializer_handlers.get(
+                get_serializer_handler_name(serializer_name))
+            if not serializer:
+                raise Exception("Unsupported serializer {} of {}".format(
+                    serializer_name, dest_name))
+            if self.destination_handlers[handler_name].requires_json \
+                    and not serializer.is_json:
+                raise Exception("Serializer {} of {} does not produce "
+                                "JSON".format(serializer_name, dest_name))
+            self.destination_serializers[handler_name] = serializer(
+                self.destinations_conf)
 
     def _load_payload_handlers(self):
         payload_handlers = get_payload_handlers([payloads_module])
@@ -82,6 +139,16 @@ class ENOSSMiddleware(WSGIContext):
                                  for handler_name, payload_handler
                                  in payload_handlers.items()}
 
+    def _load_configuration_cache(self):
+        # compiled configurations keyed by raw notifications sysmeta
+        self.configuration_cache = LRUCache(
+            maxsize=int(self.conf.get("conf_cache_size", 1024)),
+            ttl=float(self.conf.get("conf_cache_ttl", 300)))
+        # accounts/containers without notification configuration
+        self.unconfigured_cache = LRUCache(
+            maxsize=int(self.conf.get("negative_cache_size", 10000)),
+            ttl=float(self.conf.get("negative_cache_ttl", 10)))
+
     def _load_admin_s3_conf(self):
         self.admin_s3_conf = None
         admin_s3_conf_path = self.conf.get("admin_s3_conf_path")
@@ -96,89 +163,399 @@ class ENOSSMiddleware(WSGIContext):
                         self.destination_handlers,
                         self.payload_handlers,
                         admin_s3_conf)
-                    self.admin_s3_conf = admin_s3_conf
+                    self.admin_s3_conf = self._compile_configuration(
+                        admin_s3_conf)
             except Exception as e:
                 self.logger.error("error during loading admin s3 conf:{}".
                                   format(e))
 
+    def _load_spool(self):
+        # undeliverable notifications are stored per destination on disk
+        self.spools = {}
+        self.spool_replayer = None
+        spool_dir = self.conf.get("spool_dir")
+        if not spool_dir:
+            return
+        for handler_name in self.destination_handlers:
+            self.spools[handler_name] = Spool(
+                os.path.join(spool_dir, handler_name),
+                segment_size=int(self.conf.get("spool_segment_size",
+                                               67108864)),
+                fsync=config_true_value(self.conf.get("spool_fsync", False)),
+                max_bytes=int(self.conf.get("spool_max_bytes", 1073741824)))
+        self.spool_replayer = SpoolReplayer(
+            self.spools, self._replay,
+            rate=float(self.conf.get("spool_replay_rate", 100)),
+            interval=float(self.conf.get("spool_replay_interval", 5)),
+            logger=self.logger)
+
+    def _load_dispatcher(self):
+        self.dispatcher = None
+        if config_true_value(self.conf.get("async_dispatch", False)):
+            self.dispatcher = NotificationDispatcher(
+                self._deliver_batch,
+                queue_size=int(self.conf.get("dispatch_queue_size", 1024)),
+                workers=int(self.conf.get("dispatch_workers", 8)),
+                overflow_policy=self.conf.get("dispatch_overflow_policy",
+                                              "drop_newest"),
+                batch_size=int(self.conf.get("dispatch_batch_size", 64)),
+                overflow=self._spool,
+                logger=self.logger)
+
+    def _load_budget(self):
+        budget_ms = float(self.conf.get("notification_budget_ms", 0))
+        self.notification_budget = budget_ms / 1000 if budget_ms > 0 \
+            else None
+        # requests which exceeded budget and notifications dropped because
+        # of it
+        self.budget_exceeded = 0
+        self.budget_dropped = 0
+
+    def _load_stats(self):
+        # stats endpoint is enabled only with configured secret
+        self.stats_secret = self.conf.get("stats_secret")
+        self.stats_path = self.conf.get("stats_path", "/info/enoss")
+        # endpoint must not hide objects, containers or accounts
+        if valid_api_version(self.stats_path.lstrip("/").split("/")[0]):
+            raise ValueError("stats_path {} is a storage path".format(
+                self.stats_path))
+        self._profiling = False
+
     def get_notification_configuration(self, info_method, environ):
         info = info_method(environ, self.app)
         notifications_conf = info.get("sysmeta", {}).get("notifications")
         return notifications_conf
 
-    def get_current_level(self, account, container, object):
-        if object:
-            return "object"
-        elif container:
-            return "container"
-        elif account:
-            return "account"
+    def _compile_configuration(self, notifications_conf):
+        s3_conf = S3NotifiationConfiguration(notifications_conf)
+        for destination_configurations in \
+                s3_conf.destinations_configurations.values():
+            for destination_configuration in destination_configurations:
+                handler_name = get_payload_handler_name(
+                    destination_configuration.payload_type)
+                destination_configuration.payload_template = \
+                    self.payload_handlers[handler_name].compile_template(
+                        destination_configuration)
+        return s3_conf
+
+    def get_compiled_configuration(self, notifications_conf):
+        s3_conf = self.configuration_cache.get(notifications_conf)
+        if s3_conf is None:
+            self.metrics.increment("config_cache.miss")
+            try:
+                with self.metrics.timed("config_compile"):
+                    s3_conf = self._compile_configuration(notifications_conf)
+            except Exception as e:
+                # in case some invalid configuration is stored
+                self.logger.error("{}".format(e))
+                return None
+            self.configuration_cache.set(notifications_conf, s3_conf)
         else:
-            return None
+            self.metrics.increment("config_cache.hit")
+        return s3_conf
 
-    def _get_upper_level_confs(self, curr_level, req):
+    def _get_upper_level_confs(self, event):
+        if not event.bit:
+            # event which nobody can subscribe to (e.g. OPTIONS)
+            return []
+        start = time.time()
         confs = [self.admin_s3_conf] if self.admin_s3_conf else []
-        if curr_level in ["object", "container"]:
-            notifications_conf = self.get_notification_configuration(
-                get_account_info, req.environ)
-            if notifications_conf:
-                confs.append(notifications_conf)
-        if curr_level == "object":
-            notifications_conf = self.get_notification_configuration(
-                get_container_info, req.environ)
-            if notifications_conf:
-                confs.append(notifications_conf)
+        lookups = []
+        if event.level in ["object", "container"]:
+            lookups.append((get_account_info, "account/" + event.account))
+        if event.level == "object":
+            lookups.append((get_container_info, "container/{}/{}".format(
+                event.account, event.container)))
+        for info_method, cache_key in lookups:
+            if self.unconfigured_cache.get(cache_key):
+                continue
+            info = info_method(event.environ, self.app)
+            notifications_conf = info.get("sysmeta", {}).get("notifications")
+            if not notifications_conf:
+                # failed lookup (e.g. 503 HEAD) is not negative answer,
+                # it is repeated by next request
+                if is_success(info.get("status", 0)):
+                    self.unconfigured_cache.set(cache_key, True)
+                continue
+            s3_conf = self.get_compiled_configuration(notifications_conf)
+            if s3_conf:
+                confs.append(s3_conf)
+        # subscribed events are compiled together with configuration,
+        # so unsubscribed events are dropped before any rule evaluation
+        confs = [conf for conf in confs if conf.is_subscribed(event)]
+        self.metrics.timing_since("config_lookup", start)
         return confs
 
-    def _read_info_before_delete(self, req):
-        version, account, container, object = split_path(
-            req.environ['PATH_INFO'], 1, 4, rest_with_last=True)
-        if object:
-            get_object_info(req.environ, self.app)
-        elif container or account:
-            get_info(self.app, req.environ, account, container)
+    def _needs_metadata(self, event, upper_level_confs):
+        for s3_conf in upper_level_confs:
+            for destination_configurations in \
+                    s3_conf.destinations_configurations.values():
+                for destination_configuration in destination_configurations:
+                    if not destination_configuration.is_allowed_event(event):
+                        continue
+                    if destination_configuration.needs_metadata:
+                        return True
+                    handler_name = get_payload_handler_name(
+                        destination_configuration.payload_type)
+                    if self.payload_handlers[handler_name].needs_metadata:
+                        return True
+        return False
+
+    def _read_info_before_delete(self, event, upper_level_confs):
+        if not self._needs_metadata(event, upper_level_confs):
+            # nothing will read metadata of deleted object/container
+            return
+        # info is cached in event (and infocache) for rules and payloads
+        if event.object:
+            event.object_info
+        elif event.container:
+            event.container_info
+        elif event.account:
+            event.account_info
+
+    def _send_timer(self, handler_name):
+        timeout = self.send_timeouts.get(handler_name)
+        return eventlet.Timeout(timeout) if timeout else None
+
+    def _deliver(self, handler_name, notification, event):
+        breaker = self.circuit_breakers.get(handler_name)
+        if breaker and not breaker.allow():
+            # destination is down, do not wait for its timeout
+            raise CircuitOpen(handler_name)
+        destination = self.destination_handlers[handler_name]
+        start = time.time()
+        timer = self._send_timer(handler_name)
+        try:
+            destination.send_notification(notification, event)
+        except eventlet.Timeout as e:
+            # own send timeout or notification budget of request
+            self.metrics.destination_increment(handler_name, "failure")
+            if e is not timer:
+                # exhausted budget of request is not failure of destination
+                if breaker:
+                    breaker.record_cancelled()
+                raise
+            if breaker:
+                breaker.record_failure()
+            raise SendTimeout(handler_name, timer.seconds)
+        except Exception:
+            self.metrics.destination_increment(handler_name, "failure")
+            if breaker:
+                breaker.record_failure()
+            raise
+        finally:
+            if timer:
+                timer.cancel()
+            self.metrics.destination_timing_since(handler_name, start)
+        if destination.buffered:
+            # result is reported once notification is really sent
+            return
+        self.metrics.destination_increment(handler_name, "success")
+        if breaker:
+            breaker.record_success()
+
+    def _on_buffered_delivered(self, handler_name, count):
+        self.metrics.destination_increment(handler_name, "success", count)
+        breaker = self.circuit_breakers.get(handler_name)
+        if breaker:
+            for _ in range(count):
+                breaker.record_success()
 
-    def send_test_notification(self, curr_level, req):
+    def _on_buffered_failed(self, handler_name, notification, error):
+        self.metrics.destination_increment(handler_name, "failure")
+        breaker = self.circuit_breakers.get(handler_name)
+        if breaker:
+            breaker.record_failure()
+        self._on_delivery_error(handler_name, notification, error)
+
+    def _spool(self, handler_name, notification, event=None):
+        spool = self.spools.get(handler_name)
+        if spool is None:
+            self.metrics.destination_increment(handler_name, "dropped")
+            return
+        try:
+            spool.append(notification)
+        except SpoolFull:
+            self.metrics.destination_increment(handler_name, "dropped")
+            return
+        except Exception as e:
+            self.metrics.destination_increment(handler_name, "dropped")
+            self.logger.error("error during spooling notification to {}: "
+                              "{}".format(handler_name, e))
+            return
+        self.metrics.destination_increment(handler_name, "spooled")
+
+    def _is_retryable(self, handler_name, error):
+        if isinstance(error, (CircuitOpen, SendTimeout, BudgetExceeded)):
+            return True
+        return self.destination_handlers[handler_name].is_retryable(error)
+
+    def _on_delivery_error(self, handler_name, notification, error):
+        if not isinstance(error, CircuitOpen):
+            self.logger.error("error during sending notification to {}: "
+                              "{}".format(handler_name, error))
+        if self._is_retryable(handler_name, error):
+            self._spool(handler_name, notification)
+        else:
+            # would fail again, e.g. notification is too big
+            self.metrics.destination_increment(handler_name, "dropped")
+
+    def _replay(self, handler_name, notification, event):
+        # notification which can never be sent must not block the spool
+        try:
+            self._deliver(handler_name, notification, event)
+        except Exception as e:
+            if self._is_retryable(handler_name, e):
+                raise
+            self.logger.error("dropping spooled notification to {}: "
+                              "{}".format(handler_name, e))
+            self.metrics.destination_increment(handler_name, "dropped")
+
+    def _deliver_batch(self, handler_name, notifications):
+        breaker = self.circuit_breakers.get(handler_name)
+        if breaker and not breaker.allow():
+            errors = [CircuitOpen(handler_name)] * len(notifications)
+        else:
+            start = time.time()
+            timer = self._send_timer(handler_name)
+            destination = self.destination_handlers[handler_name]
+            # results are filled in by destination as they are known
+            errors = [_pending] * len(notifications)
+            timed_out = False
+            try:
+                destination.send_notifications(notifications, errors)
+            except eventlet.Timeout as e:
+                if e is not timer:
+                    raise
+                # only notifications without result are failed
+                timed_out = True
+                error = SendTimeout(handler_name, timer.seconds)
+                errors = [error if result is _pending else result
+                          for result in errors]
+            finally:
+                if timer:
+                    timer.cancel()
+                self.metrics.destination_timing_since(handler_name, start)
+            failures = len(errors) - errors.count(None)
+            # results of buffered notifications are reported later
+            if not destination.buffered:
+                self.metrics.destination_increment(
+                    handler_name, "success", len(errors) - failures)
+            if failures:
+                self.metrics.destination_increment(
+                    handler_name, "failure", failures)
+            if breaker:
+                for error in errors:
+                    if error is None:
+                        if not destination.buffered:
+                            breaker.record_success()
+                    elif not isinstance(error, SendTimeout):
+                        breaker.record_failure()
+                if timed_out:
+                    # slow batch is single failure of destination
+                    breaker.record_failure()
+        for (notification, _), error in zip(notifications, errors):
+            if error is not None:
+                self._on_delivery_error(handler_name, notification, error)
+
+    def _dispatch(self, handler_name, notification, event):
+        if self.dispatcher:
+            # response is returned without waiting for destination, only
+            # encoded notification and fields needed by destination wait in
+            # queue
+            self.dispatcher.put(handler_name, notification,
+                                event.get_summary() if event else None)
+            self.metrics.queue_depth(self.dispatcher.qsize())
+        else:
+            try:
+                self._deliver(handler_name, notification, event)
+            except Exception as e:
+                self._on_delivery_error(handler_name, notification, e)
+
+    def _get_notification_payload(self, event, destination_configuration,
+                                  dest_handler_name):
+        handler_name = get_payload_handler_name(
+            destination_configuration.payload_type)
+        payload_handler = self.payload_handlers[handler_name]
+        cache_key = (handler_name,
+                     payload_handler.get_cache_key(destination_configuration))
+        # payload is created once per event and encoded once per serializer
+        payload = event.payloads.get(cache_key)
+        if payload is None:
+            with self.metrics.timed("payload"):
+                payload = payload_handler.create_payload(
+                    event, destination_configuration)
+            event.payloads[cache_key] = payload
+        serializer = self.destination_serializers[dest_handler_name]
+        encoded_key = cache_key + (serializer.__class__.__name__,)
+        notification = event.encoded_payloads.get(encoded_key)
+        if notification is None:
+            with self.metrics.timed("serialization"):
+                notification = serializer.dumps(payload)
+            event.encoded_payloads[encoded_key] = notification
+        return notification
+
+    def send_test_notification(self, event):
         # todo check if curr_level is not None
-        info_method = get_container_info if curr_level == "container" \
+        info_method = get_container_info if event.level == "container" \
             else get_account_info
         notifications_conf = self.get_notification_configuration(
-            info_method, req.environ)
-        if notifications_conf:
-            s3_conf = S3NotifiationConfiguration(notifications_conf)
+            info_method, event.environ)
+        s3_conf = self.get_compiled_configuration(notifications_conf) \
+            if notifications_conf else None
+        if s3_conf:
             for destination_name, destination_configurations in \
                     s3_conf.destinations_configurations.items():
-                handler_name = get_destination_handler_name(destination_name)
-                destination_handler = self.destination_handlers[handler_name]
+                dest_handler_name = get_destination_handler_name(
+                    destination_name)
                 for destination_configuration in destination_configurations:
                     handler_name = get_payload_handler_name(
                         destination_configuration.payload_type)
                     payload_handler = self.payload_handlers[handler_name]
                     payload = payload_handler.create_test_payload(
-                        self.app, req, destination_configuration)
-                    destination_handler.send_notification(payload)
+                        event, destination_configuration)
+                    serializer = self.destination_serializers[
+                        dest_handler_name]
+                    self._dispatch(dest_handler_name,
+                                   serializer.dumps(payload), event)
 
-    def send_notification(self, upper_level_confs, req):
-        for notification_conf in upper_level_confs:
-            try:
-                # in case some invalid configuration is stored
-                s3_conf = S3NotifiationConfiguration(notification_conf)
-            except Exception as e:
-                self.logger.error("{}".format(e))
-                continue
-            satisfied_destinations = s3_conf.get_satisfied_destinations(
-                self.app, req)
+    def _get_notifications(self, upper_level_confs, event):
+        notifications = []
+        if upper_level_confs:
+            self.metrics.increment("evaluated")
+        for s3_conf in upper_level_confs:
+            with self.metrics.timed("evaluation"):
+                satisfied_destinations = s3_conf.get_satisfied_destinations(
+                    event)
             for destination_name, destination_configurations in \
                     satisfied_destinations.items():
-                handler_name = get_destination_handler_name(destination_name)
-                destination_handler = self.destination_handlers[handler_name]
+                dest_handler_name = get_destination_handler_name(
+                    destination_name)
                 for destination_configuration in destination_configurations:
-                    handler_name = get_payload_handler_name(
-                        destination_configuration.payload_type)
-                    payload_handler = self.payload_handlers[handler_name]
-                    payload = payload_handler.create_payload(
-                        self.app, req, destination_configuration)
-                    destination_handler.send_notification(payload)
+                    notification = self._get_notification_payload(
+                        event, destination_configuration, dest_handler_name)
+                    notifications.append((dest_handler_name, notification))
+                    self.metrics.destination_increment(dest_handler_name,
+                                                       "matched")
+        return notifications
+
+    def _defer(self, notifications):
+        # notifications which could not be sent within budget
+        for handler_name, notification in notifications:
+            if handler_name not in self.spools:
+                self.budget_dropped += 1
+            self._spool(handler_name, notification)
+
+    def send_notification(self, upper_level_confs, event, budget=None):
+        budget = budget or NotificationBudget()
+        notifications = budget.run(
+            self._get_notifications, upper_level_confs, event)
+        for i, (handler_name, notification) in enumerate(notifications):
+            try:
+                budget.run(self._dispatch, handler_name, notification, event)
+            except BudgetExceeded:
+                self._defer(notifications[i:])
+                raise
 
     def _post_notification(self, curr_level, req):
         if curr_level not in ["account", "container"]:
@@ -221,17 +598,118 @@ class ENOSSMiddleware(WSGIContext):
             info_method, resp.environ)
         resp.body = str.encode(conf if conf else '')
 
+    def _on_budget_exceeded(self, event):
+        self.budget_exceeded += 1
+        self.metrics.increment("budget_exceeded")
+        self.logger.warning("notification budget exceeded: {} {}".format(
+            event.method, event.environ.get("PATH_INFO")))
+
+    def _get_cache_stats(self, cache):
+        lookups = cache.hits + cache.misses
+        return {
+            "size": len(cache),
+            "hits": cache.hits,
+            "misses": cache.misses,
+            "hit_rate": float(cache.hits) / lookups if lookups else 0,
+        }
+
+    def get_stats(self):
+        stats = self.metrics.snapshot()
+        stats["pid"] = os.getpid()
+        stats["config_cache"] = self._get_cache_stats(
+            self.configuration_cache)
+        stats["negative_cache"] = self._get_cache_stats(
+            self.unconfigured_cache)
+        stats["dispatch"] = {
+            "queue_depth": self.dispatcher.qsize(),
+            "dropped": self.dispatcher.dropped,
+        } if self.dispatcher else None
+        stats["breakers"] = {
+            handler_name: {"state": breaker.state,
+                           "rejected": breaker.rejected}
+            for handler_name, breaker in self.circuit_breakers.items()}
+        stats["spools"] = {handler_name: spool.size()
+                           for handler_name, spool in self.spools.items()}
+        stats["budget"] = {"exceeded": self.budget_exceeded,
+                           "dropped": self.budget_dropped}
+        stats["rules"] = self._get_rule_stats()
+        return stats
+
+    def _get_rule_stats(self):
+        # evaluations of rules summed over cached configurations
+        rules = {}
+        s3_confs = self.configuration_cache.values()
+        if self.admin_s3_conf:
+            s3_confs.append(self.admin_s3_conf)
+        for s3_conf in s3_confs:
+            for rule_stats in s3_conf.get_rule_stats():
+                key = (rule_stats["rule"], rule_stats["value"])
+                if key in rules:
+                    rules[key]["evaluations"] += rule_stats["evaluations"]
+                    rules[key]["matches"] += rule_stats["matches"]
+                else:
+                    rules[key] = rule_stats
+        return [rules[key] for key in sorted(rules)]
+
+    def _profile(self, seconds):
+        # greenthreads of worker run in the same thread, so profile
+        # covers requests served meanwhile
+        profiler = cProfile.Profile()
+        self._profiling = True
+        try:
+            profiler.enable()
+            try:
+                eventlet.sleep(seconds)
+            finally:
+                profiler.disable()
+        finally:
+            self._profiling = False
+        output = six.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats(
+            "cumulative").print_stats(50)
+        return output.getvalue()
+
+    def _handle_stats(self, req):
+        if not streq_const_time(req.headers["X-Enoss-Stats-Secret"],
+                                self.stats_secret):
+            return HTTPForbidden(request=req)
+        if req.method != "GET":
+            return HTTPMethodNotAllowed(request=req)
+        profile = None
+        if req.params.get("profile"):
+            try:
+                seconds = float(req.params["profile"])
+            except ValueError:
+                seconds = None
+            if seconds is None or not seconds > 0:
+                return HTTPBadRequest(request=req, content_type='text/plain',
+                                      body="Invalid profile duration")
+            seconds = min(seconds, max_profile_seconds)
+            if self._profiling:
+                return HTTPConflict(request=req, content_type='text/plain',
+                                    body="Profile is already running")
+            profile = self._profile(seconds)
+        stats = self.get_stats()
+        if profile is not None:
+            stats["profile"] = profile
+        return Response(request=req, content_type='application/json',
+                        body=json.dumps(stats).encode())
+
     @wsgify
     def __call__(self, req):
+        if self.stats_secret and req.path == self.stats_path \
+                and "X-Enoss-Stats-Secret" in req.headers:
+            return self._handle_stats(req)
         if req.headers.get("X-Backend-EventNotification-Ignore"):
             return req.get_response(self.app)
         # swift can call it self recursively
         # => we want only one notification per user request
         req.headers["X-Backend-EventNotification-Ignore"] = True
 
-        version, account, container, object = split_path(
-            req.environ['PATH_INFO'], 1, 4, rest_with_last=True)
-        curr_level = self.get_current_level(account, container, object)
+        if self.spool_replayer:
+            self.spool_replayer.ensure_started()
+        event = EventContext(self.app, req)
+        curr_level = event.level
         event_configation_changed = False
         if req.method == "POST" and req.query_string == "notification":
             resp_err = self._post_notification(curr_level, req)
@@ -241,18 +719,37 @@ class ENOSSMiddleware(WSGIContext):
                 # forbidden, bad request or server error
                 return resp_err
 
+        budget = NotificationBudget(self.notification_budget)
+        upper_level_confs = None
         if req.method == "DELETE":
-            self._read_info_before_delete(req)
+            try:
+                upper_level_confs = budget.run(
+                    self._get_upper_level_confs, event)
+                budget.run(self._read_info_before_delete, event,
+                           upper_level_confs)
+            except BudgetExceeded:
+                # no notification will be sent for this request
+                upper_level_confs = []
+                self._on_budget_exceeded(event)
 
         # get swift response
         resp = req.get_response(self.app)
+        event.set_response(resp)
+        if event_configation_changed:
+            self.unconfigured_cache.delete(
+                "account/" + event.account if curr_level == "account" else
+                "container/{}/{}".format(event.account, event.container))
 
-        upper_level_confs = self._get_upper_level_confs(curr_level, resp)
         try:
+            if upper_level_confs is None:
+                upper_level_confs = budget.run(
+                    self._get_upper_level_confs, event)
             # sending notifications can be unsuccessful and throw exceptions
             if event_configation_changed:
-                self.send_test_notification(curr_level, resp)
-            self.send_notification(upper_level_confs, resp)
+                budget.run(self.send_test_notification, event)
+            self.send_notification(upper_level_confs, event, budget)
+        except BudgetExceeded:
+            self._on_budget_exceeded(event)
         except Exception as e:
             self.logger.error("error:{}".format(e))
         # todo: better way to test query_string
@@ -0,0 +1,185 @@
+# Copyright (c) 2022 Nemanja Vasiljevic <xvasil03@gmail.com>.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from swift.common.utils import split_path, Timestamp
+from swift.proxy.controllers.base import get_account_info, \
+    get_container_info, get_object_info
+
+from enoss.constants import s3_event_bits
+from enoss.utils import get_current_level, get_s3_event_name
+
+_unknown = object()
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# fields of event used by destinations (e.g. kafka partition key) which are
+# kept until asynchronous delivery; EventContext holds whole request and
+# response (including app_iter), so it must not outlive the request
+class EventSummary(object):
+    __slots__ = ("account", "container", "object")
+
+    def __init__(self, account, container, object):
+        self.account = account
+        self.container = container
+        self.object = object
+
+
+# information about single user request shared by rules, payloads and
+# destinations: path is parsed once, event name is derived from request
+# (and again once response is known) and object/container/account info is
+# fetched only when needed
+class EventContext(object):
+    def __init__(self, app, req):
+        self.app = app
+        self.environ = req.environ
+        self.version, self.account, self.container, self.object = \
+            split_path(req.environ['PATH_INFO'], 1, 4, rest_with_last=True)
+        self.level = get_current_level(
+            self.account, self.container, self.object)
+        # name used by key filter rules
+        self.key = self.object or self.container
+        self.resp = None
+        self.status = None
+        self.is_success = False
+        self._object_info = None
+        self._container_info = None
+        self._account_info = None
+        self._size = _unknown
+        self._content_type = _unknown
+        self._etag = _unknown
+        self._timestamp = None
+        self._summary = None
+        # X-Timestamp sent by client must not be trusted, only the one
+        # assigned by proxy while handling request (PUT/DELETE)
+        self._client_timestamp = req.environ.get("HTTP_X_TIMESTAMP")
+        self._arrival_timestamp = Timestamp.now()
+        # payloads shared by destination configurations
+        self.payloads = {}
+        self.encoded_payloads = {}
+        # results of rules shared by configurations
+        self.rule_results = {}
+        self._set_method(req.method)
+
+    def _set_method(self, method):
+        self.method = method
+        self.name = get_s3_event_name(
+            self.account, self.container, self.object, self.method)
+        # events out of supported_s3_events can not be subscribed to
+        self.bit = s3_event_bits.get(self.name, 0)
+
+    def set_response(self, resp):
+        self.resp = resp
+        # downstream middlewares can change method (e.g. COPY => PUT)
+        self._set_method(resp.environ.get('swift.orig_req_method',
+                                          resp.request.method))
+        self.status = resp.status_int
+        self.is_success = resp.is_success
+
+    @property
+    def object_info(self):
+        if self._object_info is None:
+            self._object_info = get_object_info(self.environ, self.app)
+        return self._object_info
+
+    @property
+    def container_info(self):
+        if self._container_info is None:
+            self._container_info = get_container_info(self.environ, self.app)
+        return self._container_info
+
+    @property
+    def account_info(self):
+        if self._account_info is None:
+            self._account_info = get_account_info(self.environ, self.app)
+        return self._account_info
+
+    def _is_object_response(self):
+        # response of successful GET/HEAD/PUT describes the object itself
+        return self.is_success and self.method in ["GET", "HEAD", "PUT"]
+
+    def _read_size(self):
+        if not self.object:
+            if self.is_success and self.method in ["GET", "HEAD"]:
+                header = "X-Container-Bytes-Used" if self.container \
+                    else "X-Account-Bytes-Used"
+                if header in self.resp.headers:
+                    return self.resp.headers[header]
+            info = self.container_info if self.container \
+                else self.account_info
+            return info.get("bytes")
+        if self.method == "PUT" and self.is_success:
+            size = self.environ.get("CONTENT_LENGTH")
+            if size is not None:
+                return size
+        elif self.method in ["GET", "HEAD"] and self.status == 200:
+            # partial content would report length of the range only
+            size = self.resp.headers.get("Content-Length")
+            if size is not None:
+                return size
+        return self.object_info.get("length")
+
+    def get_size(self):
+        if self._size is _unknown:
+            self._size = _to_int(self._read_size())
+        return self._size
+
+    def get_content_type(self):
+        if self._content_type is _unknown:
+            if self.method == "PUT":
+                # read content type from request headers
+                self._content_type = self.environ.get("CONTENT_TYPE")
+            elif self._is_object_response():
+                # read content type from respond headers
+                self._content_type = self.resp.headers.get("Content-Type")
+            else:
+                # read content type from object storage
+                object_info = self.object_info
+                self._content_type = object_info.get("type") \
+                    if object_info.get("status") == 200 else None
+        return self._content_type
+
+    def get_timestamp(self):
+        # time assigned to request by proxy or time of request arrival,
+        # same for all notifications
+        if self._timestamp is None:
+            self._timestamp = self._arrival_timestamp
+            timestamp = self.environ.get("HTTP_X_TIMESTAMP")
+            if timestamp and timestamp != self._client_timestamp:
+                try:
+                    self._timestamp = Timestamp(timestamp)
+                except ValueError:
+                    pass
+        return self._timestamp
+
+    def get_summary(self):
+        if self._summary is None:
+            self._summary = EventSummary(
+                self.account, self.container, self.object)
+        return self._summary
+
+    def get_etag(self):
+        if self._etag is _unknown:
+            etag = self.resp.headers.get("Etag") \
+                if self._is_object_response() else None
+            if etag is None:
+                etag = self.object_info.get("etag")
+            self._etag = etag
+        return self._etag
@@ -14,28 +14,16 @@
 # limitations under the License.
 
 from enoss.filter_rules.irule import IRule
-from swift.proxy.controllers.base import get_object_info
 
 
 class ContenttypeRule(IRule):
+    needs_metadata = True
+    cost = 10
 
     @staticmethod
     def validate(value):
         return type(value) == str
 
-    def __call__(self, app, resp):
-        method = resp.environ.get('swift.orig_req_method', resp.request.method)
-        content_type = None
-        if method == "PUT":
-            # read content type from request headers
-            content_type = resp.environ.get("CONTENT_TYPE")
-        elif method in ["GET", "HEAD"]:
-            # read content type from respond headers
-            content_type = resp.headers.get("Content-Type")
-        else:
-            # read content type from object storage
-            object_info = get_object_info(resp.environ, app)
-            if object_info["status"] == 200:
-                # if object exists in storage
-                content_type = object_info.get("type")
+    def __call__(self, event):
+        content_type = event.get_content_type()
         return content_type and content_type == self.value
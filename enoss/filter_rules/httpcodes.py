@@ -16,27 +16,78 @@
 from enoss.filter_rules.irule import IRule
 
 
+_status_codes = range(100, 1000)
+_min_code, _max_code = _status_codes[0], _status_codes[-1]
+
+
 class HttpcodesRule(IRule):
+    # patterns are exact codes ("404"), codes with wildcards ("4xx"),
+    # ranges ("500-599") and their negations ("!404"); they are compiled
+    # into set of matching codes once
+
+    @staticmethod
+    def _range(pattern):
+        # returns (low, high) of range pattern or None if it is invalid
+        low, _, high = pattern.partition("-")
+        if not (low.isdigit() and high.isdigit()) or int(low) > int(high):
+            return None
+        return int(low), int(high)
+
+    @staticmethod
+    def _parse(pattern):
+        # returns (negated, matching codes) or None if pattern is invalid
+        negated = pattern.startswith("!")
+        if negated:
+            pattern = pattern[1:]
+        if "-" in pattern:
+            bounds = HttpcodesRule._range(pattern)
+            if bounds is None:
+                return None
+            # clamped to status codes => at most len(_status_codes) entries
+            low, high = max(bounds[0], _min_code), min(bounds[1], _max_code)
+            return negated, set(range(low, high + 1))
+        if not pattern or any(char not in "0123456789x" for char in pattern):
+            return None
+        codes = set()
+        for code in _status_codes:
+            code_str = str(code)
+            if len(code_str) == len(pattern) and all(
+                    char == "x" or char == code_char
+                    for char, code_char in zip(pattern, code_str)):
+                codes.add(code)
+        return negated, codes
 
     @staticmethod
     def validate(values):
-        # values must be a list of strings (e.g. ["200", "404", "4xx"])
-        allowed_chars = ['x', '0', '1', '2', '3', '4', '5', '6', '7', '8', '9']
+        # values must be a list of strings (e.g. ["200", "4xx", "!404"])
         if type(values) != list:
             return False
         for val in values:
-            if type(val) != str or any(x not in allowed_chars for x in val):
+            if type(val) != str:
                 return False
-        return True
-
-    def _cmp(self, val_1, val_2):
-        if len(val_1) != len(val_2):
-            return False
-        for i in range(len(val_1)):
-            if val_1[i] != val_2[i] and val_2[i] != 'x':
+            if "-" in val:
+                # ranges must stay within status codes (100-999)
+                bounds = HttpcodesRule._range(
+                    val[1:] if val.startswith("!") else val)
+                if bounds is None or bounds[0] < _min_code \
+                        or bounds[1] > _max_code:
+                    return False
+            parsed = HttpcodesRule._parse(val)
+            # pattern must match some status code (e.g. not "99" or "xxxx")
+            if parsed is None or not parsed[1]:
                 return False
         return True
 
-    def __call__(self, app, resp):
-        status = str(resp.status_int)
-        return any(self._cmp(status, x) for x in self.value)
+    def __init__(self, value):
+        super(HttpcodesRule, self).__init__(value)
+        included = set()
+        excluded = set()
+        for negated, codes in map(self._parse, value):
+            (excluded if negated else included).update(codes)
+        if not included and excluded:
+            # only negations => any other status
+            included = set(_status_codes)
+        self.codes = frozenset(included - excluded)
+
+    def __call__(self, event):
+        return event.status in self.codes
@@ -19,13 +19,28 @@ import six
 
 @six.add_metaclass(abc.ABCMeta)
 class IRule(object):
+    # rule reads object/container metadata (e.g. size) from storage
+    needs_metadata = False
+    # "prefix"/"suffix" rules of key are matched using index of
+    # configuration instead of calling them one by one
+    key_index = None
+    # rules of filter are evaluated from the cheapest one
+    cost = 1
+
     def __init__(self, value):
         self.value = value
+        # identifies identical rules of different configurations (e.g.
+        # admin and container level), their result is computed once per
+        # event; set when rule is compiled into configuration
+        self.memo_key = None
+        # used for tuning of rules order
+        self.evaluations = 0
+        self.matches = 0
 
     @staticmethod
     def validate(value):
         raise NotImplementedError('__call__ is not implemented')
 
     @abc.abstractmethod
-    def __call__(self, app, resp):
+    def __call__(self, event):
         raise NotImplementedError('__call__ is not implemented')
@@ -14,20 +14,14 @@
 # limitations under the License.
 
 from enoss.filter_rules.irule import IRule
-from swift.common.utils import split_path
 
 
 class PrefixRule(IRule):
+    key_index = "prefix"
 
     @staticmethod
     def validate(value):
         return type(value) == str
 
-    def __call__(self, app, resp):
-        version, account, container, object = split_path(
-            resp.environ['PATH_INFO'], 1, 4, rest_with_last=True)
-        if object:
-            return object.startswith(self.value)
-        elif container:
-            return container.startswith(self.value)
-        return False
+    def __call__(self, event):
+        return bool(event.key) and event.key.startswith(self.value)
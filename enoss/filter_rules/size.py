@@ -14,40 +14,29 @@
 # limitations under the License.
 
 from enoss.filter_rules.irule import IRule
-from swift.common.utils import split_path
-from swift.proxy.controllers.base import get_account_info, get_container_info,\
-    get_object_info
-
-
-def _get_size(resp, app):
-    size = None
-    version, account, container, object = split_path(
-        resp.environ['PATH_INFO'], 1, 4, rest_with_last=True)
-    if object:
-        size = get_object_info(resp.environ, app).get("length")
-    else:
-        info_method = get_container_info if container else get_account_info
-        size = info_method(resp.environ, app).get("bytes")
-    return size
 
 
 class MaxsizeRule(IRule):
+    needs_metadata = True
+    cost = 10
 
     @staticmethod
     def validate(value):
         return type(value) == int
 
-    def __call__(self, app, resp):
-        size = _get_size(resp, app)
+    def __call__(self, event):
+        size = event.get_size()
         return size is not None and self.value >= size
 
 
 class MinsizeRule(IRule):
+    needs_metadata = True
+    cost = 10
 
     @staticmethod
     def validate(value):
         return type(value) == int
 
-    def __call__(self, app, resp):
-        size = _get_size(resp, app)
+    def __call__(self, event):
+        size = event.get_size()
         return size is not None and self.value <= size
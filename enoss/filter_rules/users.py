@@ -23,9 +23,9 @@ class UsersinRule(IRule):
         # list of strings
         return type(values) == list and all(type(x) == str for x in values)
 
-    def __call__(self, app, resp):
-        user = resp.environ.get("REMOTE_USER")
-        return user in self.values
+    def __call__(self, event):
+        user = event.environ.get("REMOTE_USER")
+        return user in self.value
 
 
 class UsersoutRule(IRule):
@@ -35,6 +35,6 @@ class UsersoutRule(IRule):
         # list of strings
         return type(values) == list and all(type(x) == str for x in values)
 
-    def __call__(self, app, resp):
-        user = resp.environ.get("REMOTE_USER")
-        return user not in self.values
+    def __call__(self, event):
+        user = event.environ.get("REMOTE_USER")
+        return user not in self.value
@@ -0,0 +1,112 @@
+# Copyright (c) 2022 Nemanja Vasiljevic <xvasil03@gmail.com>.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import defaultdict
+from contextlib import contextmanager
+import time
+
+# upper bounds (ms) of latency histogram buckets
+histogram_buckets = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500,
+                     1000, 2500, 5000)
+
+
+class Histogram(object):
+    def __init__(self, buckets=histogram_buckets):
+        self.buckets = buckets
+        # last count is for values above the last bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    def snapshot(self):
+        buckets = {"<={}".format(bucket): count for bucket, count
+                   in zip(self.buckets, self.counts)}
+        buckets[">{}".format(self.buckets[-1])] = self.counts[-1]
+        return {
+            "count": self.count,
+            "sum_ms": self.sum,
+            "avg_ms": self.sum / self.count if self.count else 0,
+            "buckets": buckets,
+        }
+
+
+class Metrics(object):
+    # statsd metrics of ENOSS stages, sent through statsd client of swift
+    # logger (nothing is sent if log_statsd_host is not configured); the
+    # same values are kept in worker for stats endpoint
+    def __init__(self, logger):
+        self.logger = logger
+        self.counters = defaultdict(int)
+        self.histograms = defaultdict(Histogram)
+        self._destination_prefixes = {}
+
+    def _destination_metric(self, handler_name, metric):
+        prefix = self._destination_prefixes.get(handler_name)
+        if prefix is None:
+            name = handler_name
+            if name.endswith("Destination"):
+                name = name[:-len("Destination")]
+            prefix = "destination.{}.".format(name.lower())
+            self._destination_prefixes[handler_name] = prefix
+        return prefix + metric
+
+    def increment(self, metric, count=1):
+        self.counters[metric] += count
+        if count == 1:
+            self.logger.increment(metric)
+        else:
+            self.logger.update_stats(metric, count)
+
+    def timing_since(self, stage, start):
+        elapsed_ms = (time.time() - start) * 1000
+        self.histograms[stage].add(elapsed_ms)
+        self.logger.timing(stage + ".timing", elapsed_ms)
+
+    @contextmanager
+    def timed(self, stage):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.timing_since(stage, start)
+
+    def destination_timing_since(self, handler_name, start):
+        self.timing_since(self._destination_metric(handler_name, "send"),
+                          start)
+
+    def destination_increment(self, handler_name, metric, count=1):
+        # matched, success, failure, spooled or dropped notifications
+        self.increment(self._destination_metric(handler_name, metric),
+                       count)
+
+    def queue_depth(self, depth):
+        # statsd client of swift has no gauges, timer gives mean/max depth
+        self.logger.timing("dispatch.queue_depth", depth)
+
+    def snapshot(self):
+        return {
+            "counters": dict(self.counters),
+            "histograms": {stage: histogram.snapshot() for stage, histogram
+                           in self.histograms.items()},
+        }
@@ -19,13 +19,27 @@ import six
 
 @six.add_metaclass(abc.ABCMeta)
 class IPayload(object):
+    # payload contains object/container metadata (e.g. size) from storage
+    needs_metadata = False
+
     def __init__(self, conf):
         self.conf = conf
 
+    def get_cache_key(self, invoking_configuration):
+        # fields of invoking configuration used in payload, configurations
+        # with the same key share payload created for the event; by default
+        # payload is not shared, handlers can return fields they really use
+        # (or () if payload does not depend on configuration)
+        return (id(invoking_configuration),)
+
+    def compile_template(self, invoking_configuration):
+        # parts of payload which are the same for every event
+        return None
+
     @abc.abstractmethod
-    def create_test_payload(self, app, request, invoking_configuration):
+    def create_test_payload(self, event, invoking_configuration):
         raise NotImplementedError('create_test_payload is not implemented')
 
     @abc.abstractmethod
-    def create_payload(self, app, request, invoking_configuration):
+    def create_payload(self, event, invoking_configuration):
         raise NotImplementedError('create_payload is not implemented')
@@ -14,109 +14,113 @@
 # limitations under the License.
 
 from datetime import datetime
-from email.utils import parsedate
-import time
 
 from enoss.payloads.ipayload import IPayload
-from enoss.utils import get_s3_event_name
-from swift.common.utils import split_path
-from swift.proxy.controllers.base import get_object_info
-
-
-def _get_object_info(object, response, app):
-    obj_info = {}
-    method = response.environ.get(
-            'swift.orig_req_method', response.request.method)
-    if method in ["GET", "HEAD"]:
-        obj_info["eTag"] =  response.headers["Etag"]
-        obj_info["length"] = response.headers["Content-Length"]
-    elif method == "PUT":
-        obj_info["eTag"] = response.headers["Etag"]
-        obj_info["length"] = response.request.headers["Content-Length"]
-    else:
-        obj_info = get_object_info(response.environ, app)
-    return obj_info
+
+_arn_prefix = "arn:aws:s3:::"
+# key of event.payloads entry with configuration independent part
+_event_record_key = ("S3Payload", "event")
+
+
+class _S3PayloadTemplate(object):
+    def __init__(self, configuration_id):
+        self.record = {
+            "eventVersion": "2.2",
+            "eventSource": "swift:s3",
+        }
+        self.s3 = {
+            "s3SchemaVersion": "1.0",
+            "configurationId": configuration_id,
+        }
 
 
 class S3Payload(IPayload):
+    # object size and eTag
+    needs_metadata = True
 
-    def create_test_payload(self, app, request, invoking_configuration):
-        version, account, container, object = split_path(
-            request.environ['PATH_INFO'], 1, 4, rest_with_last=True)
-        container = container if isinstance(container, str) else ''
-        account = account if isinstance(account, str) else ''
+    def create_test_payload(self, event, invoking_configuration):
+        container = event.container \
+            if isinstance(event.container, str) else ''
+        account = event.account if isinstance(event.account, str) else ''
 
-        event = {
+        payload = {
             "Service": "Amazon S3",
             "Event": "s3:TestEvent",
             "Time": datetime.now().isoformat(),
             "Bucket": container,
-            "RequestId": request.environ.get("swift.trans_id"),
+            "RequestId": event.environ.get("swift.trans_id"),
             "HostId": "TODO"
         }
         if container:
-            event["Bucket"] = container
+            payload["Bucket"] = container
         else:
-            event["Account"] = account
-        return event
-
-    def create_payload(self, app, request, invoking_configuration):
-        version, account, container, object = split_path(
-            request.environ['PATH_INFO'], 1, 4, rest_with_last=True)
-        object = object if isinstance(object, str) else ''
-        container = container if isinstance(container, str) else ''
-        account = account if isinstance(account, str) else ''
-
-        obj_info = _get_object_info(object, request, app) \
-		   if object else {}
-
-        method = request.environ.get(
-            'swift.orig_req_method', request.request.method)
-        event_name = get_s3_event_name(account, container, object, method)
-        object_vesion_id = request.headers.get("X-Object-Version-Id", '')
+            payload["Account"] = account
+        return payload
+
+    def get_cache_key(self, invoking_configuration):
+        # configurationId is part of the payload
+        return (invoking_configuration.id,)
+
+    def compile_template(self, invoking_configuration):
+        return _S3PayloadTemplate(invoking_configuration.id)
+
+    def _create_event_record(self, event):
+        # fields which do not depend on invoking configuration
+        object = event.object if isinstance(event.object, str) else ''
+        container = event.container \
+            if isinstance(event.container, str) else ''
+        account = event.account if isinstance(event.account, str) else ''
+
+        timestamp = event.get_timestamp()
+        object_vesion_id = event.resp.headers.get("X-Object-Version-Id", '')
         sequencer = ""
-        if method in ["PUT", "DELETE"]:
-            if object_vesion_id:
-                # version_id has more accurate timestamp
-                sequencer = object_vesion_id
-            elif 'Last-Modified' in request.headers:
-                sequencer = time.mktime(
-                    parsedate(request.headers['Last-Modified']))
-        notification_payload = {
-            "Records": [{
-                "eventVersion": "2.2",
-                "eventSource": "swift:s3",
-                # todo: check if req has timestamp
-                "eventTime": datetime.now().isoformat(),
-                "eventName": event_name,
-                "userIdentity": {
-                    "principalId": request.environ.get("REMOTE_USER")
-                },
-                "requestParameters": {
-                    "sourceIPAddress": request.environ.get("REMOTE_ADDR")
-                },
-                "responseElements": {
-                    "x-amz-request-id": request.environ.get("swift.trans_id")
-                    # todo: x-amz-host-id
-                },
-                "s3": {
-                    "s3SchemaVersion": "1.0",
-                    "configurationId": "todo",
-                    "bucket": {
-                        "name": container,
-                        "ownerIdentity": {
-                            "principalId": account
-                        },
-                        "arn": "arn:aws:s3:::" + container,
-                    },
-                    "object": {
-                        "key": object,
-                        "size": obj_info.get("length") if obj_info else 0,
-                        "eTag": obj_info.get("eTag") if obj_info else 0,
-                        "versionId": object_vesion_id if object else '',
-                        "sequencer": sequencer
-                    }
-                }
-            }]
+        if event.method in ["PUT", "DELETE"]:
+            # version_id has more accurate timestamp
+            sequencer = object_vesion_id or timestamp.normal
+
+        s3 = {}
+        s3["bucket"] = {
+            "name": container,
+            "ownerIdentity": {
+                "principalId": account
+            },
+            "arn": _arn_prefix + container,
+        }
+        s3["object"] = {
+            "key": object,
+            "size": event.get_size() if object else 0,
+            "eTag": event.get_etag() if object else 0,
+            "versionId": object_vesion_id if object else '',
+            "sequencer": sequencer
+        }
+        record = {}
+        record["eventTime"] = timestamp.isoformat
+        record["eventName"] = event.name
+        record["userIdentity"] = {
+            "principalId": event.environ.get("REMOTE_USER")
         }
-        return notification_payload
+        record["requestParameters"] = {
+            "sourceIPAddress": event.environ.get("REMOTE_ADDR")
+        }
+        record["responseElements"] = {
+            "x-amz-request-id": event.environ.get("swift.trans_id")
+            # todo: x-amz-host-id
+        }
+        return record, s3
+
+    def create_payload(self, event, invoking_configuration):
+        template = invoking_configuration.payload_template \
+            or self.compile_template(invoking_configuration)
+        # event part is shared by configurations with different ids
+        event_record = event.payloads.get(_event_record_key)
+        if event_record is None:
+            event_record = self._create_event_record(event)
+            event.payloads[_event_record_key] = event_record
+        event_fields, event_s3 = event_record
+
+        s3 = dict(template.s3)
+        s3.update(event_s3)
+        record = dict(template.record)
+        record.update(event_fields)
+        record["s3"] = s3
+        return {"Records": [record]}
@@ -0,0 +1,39 @@
+# Copyright (c) 2022 Nemanja Vasiljevic <xvasil03@gmail.com>.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from enoss.serializers.json import JsonSerializer
+
+__all__ = [
+    'JsonSerializer'
+]
+
+# optional serializers are available only if their library is installed
+try:
+    from enoss.serializers.orjson import OrjsonSerializer
+    __all__.append('OrjsonSerializer')
+except ImportError:
+    pass
+
+try:
+    from enoss.serializers.ujson import UjsonSerializer
+    __all__.append('UjsonSerializer')
+except ImportError:
+    pass
+
+try:
+    from enoss.serializers.msgpack import MsgpackSerializer
+    __all__.append('MsgpackSerializer')
+except ImportError:
+    pass
@@ -0,0 +1,236 @@
+# Copyright (c) 2022 Nemanja Vasiljevic <xvasil03@gmail.com>.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import errno
+import fcntl
+import functools
+import mmap
+import os
+import struct
+import time
+
+import eventlet
+
+_record_header = struct.Struct(">I")
+_segment_suffix = ".spool"
+_position_suffix = ".pos"
+# seconds after which size of spool written by other processes is read
+_size_check_interval = 1
+
+
+class SpoolFull(Exception):
+    pass
+
+
+class Spool(object):
+    # append-only log of undeliverable notifications of single destination
+    # split into segments; every process appends to its own segment and
+    # holds lock on it, so segment is never replayed while it is written
+    def __init__(self, path, segment_size=67108864, fsync=False,
+                 max_bytes=0):
+        self.path = path
+        self.segment_size = segment_size
+        self.fsync = fsync
+        # limit of size of all segments (0 => unlimited), other processes
+        # append to the same spool, so it is approximate
+        self.max_bytes = max_bytes
+        self._size = 0
+        self._size_checked = 0
+        self._pid = None
+        self._segment = None
+        self._file = None
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            # segment of parent process stays locked by parent
+            self._pid = os.getpid()
+            self._segment = None
+            self._file = None
+
+    def _rotate(self):
+        self.close()
+        try:
+            os.makedirs(self.path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        # segment names are ordered by creation time
+        while True:
+            segment = "{:020d}-{}{}".format(int(time.time() * 1000000),
+                                            os.getpid(), _segment_suffix)
+            segment_file = open(os.path.join(self.path, segment), "ab")
+            fcntl.flock(segment_file, fcntl.LOCK_EX)
+            if os.fstat(segment_file.fileno()).st_nlink:
+                break
+            # empty segment was removed by replay before it was locked
+            segment_file.close()
+        self._segment = segment
+        self._file = segment_file
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        self._segment = None
+        self._file = None
+
+    def _check_size(self, record_size):
+        if not self.max_bytes:
+            return
+        now = time.time()
+        if now - self._size_checked >= _size_check_interval:
+            self._size = self.size()
+            self._size_checked = now
+        if self._size + record_size > self.max_bytes:
+            raise SpoolFull("spool {} exceeded {} bytes".format(
+                self.path, self.max_bytes))
+
+    def append(self, notification):
+        self._check_pid()
+        # record is length prefixed notification
+        record = _record_header.pack(len(notification)) + notification
+        self._check_size(len(record))
+        if self._file is None or self._file.tell() >= self.segment_size:
+            self._rotate()
+        self._file.write(record)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._size += len(record)
+
+    def segments(self):
+        try:
+            return sorted(name for name in os.listdir(self.path)
+                          if name.endswith(_segment_suffix))
+        except OSError:
+            return []
+
+    def size(self):
+        size = 0
+        for segment in self.segments():
+            try:
+                size += os.path.getsize(os.path.join(self.path, segment))
+            except OSError:
+                pass
+        return size
+
+    def _read_position(self, path):
+        try:
+            with open(path + _position_suffix) as f:
+                return int(f.read())
+        except (IOError, OSError, ValueError):
+            return 0
+
+    def _write_position(self, path, position):
+        tmp_path = path + _position_suffix + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(position))
+        os.rename(tmp_path, path + _position_suffix)
+
+    def _remove(self, path):
+        for file_path in (path + _position_suffix, path):
+            try:
+                os.unlink(file_path)
+            except OSError:
+                pass
+
+    def _replay_segment(self, segment, send):
+        path = os.path.join(self.path, segment)
+        try:
+            segment_file = open(path, "rb")
+        except (IOError, OSError):
+            # already replayed by other process
+            return
+        with segment_file:
+            try:
+                fcntl.flock(segment_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                # written or replayed by other process
+                return
+            if os.fstat(segment_file.fileno()).st_nlink == 0:
+                return
+            size = os.fstat(segment_file.fileno()).st_size
+            position = self._read_position(path)
+            if position >= size:
+                self._remove(path)
+                return
+            records = mmap.mmap(segment_file.fileno(), 0,
+                                access=mmap.ACCESS_READ)
+            try:
+                while position + _record_header.size <= size:
+                    length, = _record_header.unpack_from(records, position)
+                    start = position + _record_header.size
+                    if start + length > size:
+                        # incomplete record (process died during write)
+                        break
+                    send(records[start:start + length])
+                    position = start + length
+                position = size
+            finally:
+                records.close()
+                # notifications sent before failure are not sent again
+                if position >= size:
+                    self._remove(path)
+                else:
+                    self._write_position(path, position)
+
+    def replay(self, send):
+        # sends spooled notifications in order, stops on first failure
+        self._check_pid()
+        for segment in self.segments():
+            if segment == self._segment:
+                if not self._file.tell():
+                    continue
+                # new notifications will be appended to new segment
+                self.close()
+            self._replay_segment(segment, send)
+
+
+class SpoolReplayer(object):
+    def __init__(self, spools, deliver, rate=100, interval=5, logger=None):
+        self.spools = spools
+        self.deliver = deliver
+        self.rate = rate
+        self.interval = interval
+        self.logger = logger
+        self._pid = None
+
+    def ensure_started(self):
+        # proxy workers are forked after the middleware is loaded
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        eventlet.spawn_n(self._run)
+
+    def _run(self):
+        while True:
+            eventlet.sleep(self.interval)
+            self.replay()
+
+    def _send(self, handler_name, notification):
+        # original event is not spooled
+        self.deliver(handler_name, notification, None)
+        if self.rate > 0:
+            eventlet.sleep(1.0 / self.rate)
+
+    def replay(self):
+        for handler_name, spool in self.spools.items():
+            try:
+                spool.replay(functools.partial(self._send, handler_name))
+            except Exception as e:
+                # destination is still unavailable, retry in next round
+                if self.logger:
+                    self.logger.warning("replay of spooled notifications to "
+                                        "{} failed: {}".format(handler_name,
+                                                               e))
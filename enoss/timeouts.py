@@ -0,0 +1,52 @@
+# Copyright (c) 2022 Nemanja Vasiljevic <xvasil03@gmail.com>.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+import eventlet
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class SendTimeout(Exception):
+    def __init__(self, handler_name, timeout):
+        super(SendTimeout, self).__init__(
+            "{} did not respond in {}s".format(handler_name, timeout))
+
+
+class NotificationBudget(object):
+    # time which single request can spend on notifications, shared by
+    # metadata lookups, rule evaluation and sends (None => unlimited)
+    def __init__(self, seconds=None):
+        self.remaining = seconds
+
+    def run(self, func, *args):
+        if self.remaining is None:
+            return func(*args)
+        if self.remaining <= 0:
+            raise BudgetExceeded()
+        start = time.time()
+        timer = eventlet.Timeout(self.remaining)
+        try:
+            return func(*args)
+        except eventlet.Timeout as e:
+            if e is not timer:
+                raise
+            raise BudgetExceeded()
+        finally:
+            timer.cancel()
+            self.remaining -= time.time() - start
@@ -16,26 +16,55 @@
 import inspect
 import sys
 
+from enoss.constants import s3_event_bits
 
-def get_s3_event_name(account, container, object, method):
-    res = "s3"
+
+_s3_event_names = {}
+
+
+def get_current_level(account, container, object):
     if object:
-        res += ":Object"
+        return "object"
     elif container:
-        res += ":Bucket"
+        return "container"
+    elif account:
+        return "account"
     else:
-        res += ":Account"
+        return None
 
-    if method in ["PUT", "POST", "COPY"]:
-        res += "Created"
-    elif method in ["DELETE"]:
-        res += "Deleted"
-    else:
-        res += "Accessed"
-
-    res += ":" + method.title()
 
-    return res
+def get_s3_event_name(account, container, object, method):
+    if object:
+        resource = "Object"
+    elif container:
+        resource = "Bucket"
+    else:
+        resource = "Account"
+    event_name = _s3_event_names.get((resource, method))
+    if event_name is None:
+        if method in ["PUT", "POST", "COPY"]:
+            action = "Created"
+        elif method in ["DELETE"]:
+            action = "Removed"
+        else:
+            action = "Accessed"
+        event_name = "s3:{}{}:{}".format(resource, action, method.title())
+        # method comes from client, do not let arbitrary methods grow cache
+        if len(_s3_event_names) < 64:
+            _s3_event_names[(resource, method)] = event_name
+    return event_name
+
+
+def get_s3_event_mask(events):
+    mask = 0
+    for allowed_event in events:
+        for event, bit in s3_event_bits.items():
+            if allowed_event.endswith("*"):
+                if event.startswith(allowed_event[:-1]):
+                    mask |= bit
+            elif allowed_event == event:
+                mask |= bit
+    return mask
 
 
 def __get_handler_class_name(handler_name, handler_suffix):
@@ -54,6 +83,10 @@ def get_payload_handler_name(payload_name):
     return __get_handler_class_name(payload_name, "Payload")
 
 
+def get_serializer_handler_name(serializer_name):
+    return __get_handler_class_name(serializer_name, "Serializer")
+
+
 def __get_handlers(handler_modules, handler_suffix):
     handlers = {}
     interface_class_name = "I" + handler_suffix.title()
@@ -78,6 +111,10 @@ def get_rule_handlers(rule_modules):
     return __get_handlers(rule_modules, "Rule")
 
 
+def get_serializer_handlers(serializer_modules):
+    return __get_handlers(serializer_modules, "Serializer")
+
+
 def _byteify(data, ignore_dicts=False):
     if isinstance(data, str):
         return data
@@ -16,34 +16,52 @@
 import unittest
 from unittest.mock import patch
 
+import eventlet
+import fcntl
+import functools
 import json
 import os
+import shutil
+import tempfile
 
 from swift.common.swob import HTTPOk, Request
 
 from swift.common.request_helpers import get_sys_meta_prefix
+from swift.common.utils import Timestamp
 
+from enoss.breaker import CircuitBreaker
+from enoss.cache import LRUCache
 from enoss.configuration import filter_rule_handlers, \
-    ConfigurationInvalid
+    ConfigurationInvalid, S3NotifiationConfiguration
+from enoss.constants import s3_event_bits
 from enoss.destinations.idestination \
     import IDestination
+from enoss.dispatcher import NotificationDispatcher
+from enoss.event import EventContext, EventSummary
+from enoss.spool import Spool, SpoolFull
+from enoss.timeouts import BudgetExceeded, NotificationBudget, \
+    SendTimeout
 from enoss.enoss import ENOSSMiddleware
 from enoss.filter_rules.irule import IRule
 from enoss.payloads.ipayload import IPayload
+from enoss.payloads.s3 import S3Payload
+from enoss.utils import get_s3_event_mask
 
 from test.debug_logger import debug_logger
 from test.unit.common.middleware.helpers import FakeSwift
 
 
-class MockDestination(object):
-    def __init__(self, conf):
+class MockDestination(IDestination):
+    def __init__(self, conf, logger=None):
         self.reset()
 
     def reset(self):
         self.state = 'notification not sent'
+        self.notifications = []
 
-    def send_notification(self, notification):
+    def send_notification(self, notification, event):
         self.state = 'notification sent'
+        self.notifications.append(notification)
 
 
 class TestENOSS(unittest.TestCase):
@@ -92,15 +110,18 @@ class TestENOSS(unittest.TestCase):
            new=MockDestination)
     @patch('enoss.destinations.ElasticsearchDestination',
            new=MockDestination)
-    def test_1_init(self):
+    def _create_app(self, **extra_conf):
         app_conf = {
             'use_destinations': 'beanstalkd',
             'destinations_conf_path': '/tmp/enoss-destinations.conf',
             's3_schema': '/etc/swift/enoss/configuration-schema.json'
         }
+        app_conf.update(extra_conf)
+        return ENOSSMiddleware(self.fake_swift, app_conf, logger=self.logger)
+
+    def test_1_init(self):
         # enoss middleware initializes all payload/destination/filter handlers
-        self.app = ENOSSMiddleware(self.fake_swift, app_conf,
-                                   logger=self.logger)
+        self.app = self._create_app()
 
     def test_2_handlers(self):
         def check_interface(self, module, interface):
@@ -372,6 +393,1217 @@ class TestENOSS(unittest.TestCase):
         self.assertEqual(beanstalkd.state, 'notification sent')
         # todo fix ResourceWarning
 
+    def test_9_async_dispatch(self):
+        self.app = self._create_app(async_dispatch='true')
+        self.fake_swift.register('GET', '/v1/a5/c5/o5.jpg',
+                                 HTTPOk, {}, 'passed')
+
+        beanstalkd = self.app.destination_handlers["BeanstalkdDestination"]
+        beanstalkd.reset()
+
+        infocache = {
+            'account/a5': {'sysmeta': {}},
+            'container/a5/c5': {
+                'sysmeta': {
+                    'notifications': json.dumps(self.s3_notification_conf)
+                }
+            }
+        }
+        req = Request.blank(
+            '/v1/a5/c5/o5.jpg',
+            environ={'REQUEST_METHOD': 'GET', 'swift.infocache': infocache}
+        )
+        res = req.get_response(self.app)
+        self.assertEqual(res.status_int, 200)
+        # notification is waiting in queue until dispatcher gets a chance
+        self.assertEqual(beanstalkd.state, 'notification not sent')
+        self.assertEqual(self.app.dispatcher.qsize(), 1)
+        # queued item does not keep request nor response
+        _, notification, event = self.app.dispatcher.queue.queue[0]
+        self.assertIsInstance(notification, bytes)
+        self.assertIsInstance(event, EventSummary)
+        self.assertEqual((event.account, event.container, event.object),
+                         ('a5', 'c5', 'o5.jpg'))
+        eventlet.sleep(0)
+        self.assertEqual(beanstalkd.state, 'notification sent')
+        self.assertEqual(self.app.dispatcher.qsize(), 0)
+
+    def test_10_dispatcher_overflow(self):
+        delivered = []
+
+        def deliver(handler_name, notifications):
+            delivered.extend(notification for notification, _
+                             in notifications)
+
+        self.assertRaises(ValueError, NotificationDispatcher, deliver,
+                          overflow_policy="invalid")
+
+        dispatcher = NotificationDispatcher(
+            deliver, queue_size=2, workers=1, overflow_policy="drop_newest")
+        self.assertTrue(dispatcher.put("h", 1, None))
+        self.assertTrue(dispatcher.put("h", 2, None))
+        self.assertFalse(dispatcher.put("h", 3, None))
+        self.assertEqual(dispatcher.dropped, 1)
+        eventlet.sleep(0)
+        self.assertEqual(delivered, [1, 2])
+
+        del delivered[:]
+        dispatcher = NotificationDispatcher(
+            deliver, queue_size=2, workers=1, overflow_policy="drop_oldest")
+        dispatcher.put("h", 1, None)
+        dispatcher.put("h", 2, None)
+        self.assertFalse(dispatcher.put("h", 3, None))
+        self.assertEqual(dispatcher.dropped, 1)
+        eventlet.sleep(0)
+        self.assertEqual(delivered, [2, 3])
+
+    def test_11_configuration_cache(self):
+        self.test_1_init()
+        raw_conf = json.dumps(self.s3_notification_conf)
+        cache = self.app.configuration_cache
+        s3_conf = self.app.get_compiled_configuration(raw_conf)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        # identical configuration is compiled only once
+        self.assertIs(self.app.get_compiled_configuration(raw_conf), s3_conf)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        # invalid configuration is not cached
+        self.assertIsNone(self.app.get_compiled_configuration('{'))
+        self.assertEqual(len(cache), 1)
+
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        # least recently used entry is evicted
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+        cache = LRUCache(maxsize=2, ttl=10)
+        with patch('enoss.cache.time.time', return_value=100):
+            cache.set('a', 1)
+        with patch('enoss.cache.time.time', return_value=105):
+            self.assertEqual(cache.get('a'), 1)
+        with patch('enoss.cache.time.time', return_value=111):
+            self.assertIsNone(cache.get('a'))
+
+    def test_12_event_context(self):
+        self.fake_swift.register('DELETE', '/v1/a6/c6/d/o6.jpg',
+                                 HTTPOk, {}, 'passed')
+        req = Request.blank('/v1/a6/c6/d/o6.jpg',
+                            environ={'REQUEST_METHOD': 'DELETE'})
+        event = EventContext(self.fake_swift, req)
+        self.assertEqual((event.account, event.container, event.object),
+                         ('a6', 'c6', 'd/o6.jpg'))
+        self.assertEqual(event.level, 'object')
+        self.assertEqual(event.key, 'd/o6.jpg')
+        self.assertEqual(event.name, 's3:ObjectRemoved:Delete')
+        self.assertIsNone(event.status)
+
+        event.set_response(req.get_response(self.fake_swift))
+        self.assertEqual(event.name, 's3:ObjectRemoved:Delete')
+        self.assertEqual(event.status, 200)
+        self.assertTrue(event.is_success)
+
+        with patch('enoss.event.get_object_info',
+                   return_value={'length': 5}) as get_object_info:
+            self.assertEqual(event.object_info['length'], 5)
+            self.assertEqual(event.object_info['length'], 5)
+            # object info is fetched only once per request
+            self.assertEqual(get_object_info.call_count, 1)
+
+        req = Request.blank('/v1/a6/c6', environ={'REQUEST_METHOD': 'PUT'})
+        event = EventContext(self.fake_swift, req)
+        self.assertEqual(event.level, 'container')
+        self.assertEqual(event.key, 'c6')
+
+    def test_13_event_mask(self):
+        self.assertEqual(get_s3_event_mask(["*"]),
+                         sum(s3_event_bits.values()))
+        self.assertEqual(
+            get_s3_event_mask(["s3:ObjectCreated:*"]),
+            s3_event_bits["s3:ObjectCreated:Put"]
+            | s3_event_bits["s3:ObjectCreated:Post"]
+            | s3_event_bits["s3:ObjectCreated:Copy"])
+        self.assertEqual(
+            get_s3_event_mask(["s3:ObjectRemoved:Delete",
+                               "s3:BucketAccessed:Get"]),
+            s3_event_bits["s3:ObjectRemoved:Delete"]
+            | s3_event_bits["s3:BucketAccessed:Get"])
+
+        beanstalkd_conf = self.s3_notification_conf["BeanstalkdConfigrations"]
+        beanstalkd_conf[0]["Events"] = ["s3:ObjectCreated:*"]
+        beanstalkd_conf.append({"Id": "test2",
+                                "Events": ["s3:ObjectRemoved:*"]})
+        s3_conf = S3NotifiationConfiguration(self.s3_notification_conf)
+
+        def get_event(method):
+            self.fake_swift.register(method, '/v1/a7/c7/o7.jpg',
+                                     HTTPOk, {}, 'passed')
+            req = Request.blank('/v1/a7/c7/o7.jpg',
+                                environ={'REQUEST_METHOD': method})
+            event = EventContext(self.fake_swift, req)
+            event.set_response(req.get_response(self.fake_swift))
+            return event
+
+        put_event, get_event, delete_event = map(
+            get_event, ["PUT", "GET", "DELETE"])
+        self.assertTrue(s3_conf.is_subscribed(put_event))
+        self.assertTrue(s3_conf.is_subscribed(delete_event))
+        # no configuration cares about object reads
+        self.assertFalse(s3_conf.is_subscribed(get_event))
+        self.assertEqual(s3_conf.get_satisfied_destinations(get_event), {})
+        satisfied = s3_conf.get_satisfied_destinations(delete_event)
+        self.assertEqual([conf.id for conf in satisfied["beanstalkd"]],
+                         ["test2"])
+
+    def test_14_skip_unsubscribed_events(self):
+        self.test_1_init()
+        self.s3_notification_conf["BeanstalkdConfigrations"][0]["Events"] = \
+            ["s3:ObjectCreated:*"]
+        infocache = {
+            'account/a8': {'sysmeta': {}},
+            'container/a8/c8': {
+                'sysmeta': {
+                    'notifications': json.dumps(self.s3_notification_conf)
+                }
+            }
+        }
+
+        def get_event(method):
+            self.fake_swift.register(method, '/v1/a8/c8/o8.jpg',
+                                     HTTPOk, {}, 'passed')
+            req = Request.blank('/v1/a8/c8/o8.jpg', environ={
+                'REQUEST_METHOD': method, 'swift.infocache': infocache})
+            event = EventContext(self.fake_swift, req)
+            event.set_response(req.get_response(self.fake_swift))
+            return event
+
+        self.assertEqual(len(self.app._get_upper_level_confs(
+            get_event("PUT"))), 1)
+        self.assertEqual(self.app._get_upper_level_confs(
+            get_event("GET")), [])
+        with patch('enoss.enoss.get_account_info') as get_account_info:
+            # event out of supported events leaves without any lookup
+            self.assertEqual(self.app._get_upper_level_confs(
+                get_event("OPTIONS")), [])
+            self.assertFalse(get_account_info.called)
+
+    def test_15_negative_cache(self):
+        self.test_1_init()
+        self.fake_swift.register('GET', '/v1/a9/c9/o9.jpg',
+                                 HTTPOk, {}, 'passed')
+        self.fake_swift.register('POST', '/v1/a9/c9', HTTPOk, {}, 'passed')
+        infocache = {'account/a9': {'sysmeta': {}},
+                     'container/a9/c9': {'sysmeta': {}}}
+
+        def get_object():
+            req = Request.blank('/v1/a9/c9/o9.jpg', environ={
+                'REQUEST_METHOD': 'GET', 'swift.infocache': infocache})
+            return req.get_response(self.app)
+
+        # failed lookup is not cached as missing configuration
+        with patch('enoss.enoss.get_container_info',
+                   return_value={'status': 503, 'sysmeta': {}}) \
+                as get_container_info:
+            self.assertEqual(get_object().status_int, 200)
+            self.assertEqual(get_object().status_int, 200)
+            self.assertEqual(get_container_info.call_count, 2)
+        self.assertIsNone(self.app.unconfigured_cache.get('container/a9/c9'))
+
+        with patch('enoss.enoss.get_container_info',
+                   return_value={'status': 204, 'sysmeta': {}}) \
+                as get_container_info:
+            self.assertEqual(get_object().status_int, 200)
+            self.assertEqual(get_container_info.call_count, 1)
+            # container without configuration is not looked up again
+            self.assertEqual(get_object().status_int, 200)
+            self.assertEqual(get_container_info.call_count, 1)
+        self.assertTrue(self.app.unconfigured_cache.get('container/a9/c9'))
+
+        # storing configuration through this proxy invalidates cache
+        req = Request.blank(
+            '/v1/a9/c9?notification',
+            environ={'REQUEST_METHOD': 'POST', 'swift.infocache': infocache},
+            body=json.dumps(self.s3_notification_conf)
+        )
+        self.assertEqual(req.get_response(self.app).status_int, 200)
+        self.assertIsNone(self.app.unconfigured_cache.get('container/a9/c9'))
+
+    def test_16_read_info_before_delete(self):
+        self.test_1_init()
+        self.fake_swift.register('DELETE', '/v1/a10/c10/o10.jpg',
+                                 HTTPOk, {}, 'passed')
+        beanstalkd = self.app.destination_handlers["BeanstalkdDestination"]
+        beanstalkd_conf = self.s3_notification_conf["BeanstalkdConfigrations"]
+
+        def delete_object(events):
+            beanstalkd.reset()
+            beanstalkd_conf[0]["Events"] = events
+            infocache = {
+                'account/a10': {'sysmeta': {}},
+                'container/a10/c10': {
+                    'sysmeta': {
+                        'notifications': json.dumps(self.s3_notification_conf)
+                    }
+                }
+            }
+            req = Request.blank('/v1/a10/c10/o10.jpg', environ={
+                'REQUEST_METHOD': 'DELETE', 'swift.infocache': infocache})
+            with patch('enoss.event.get_object_info', return_value={
+                    'status': 200, 'length': 3}) as get_object_info:
+                self.assertEqual(req.get_response(self.app).status_int, 200)
+            return get_object_info.call_count
+
+        # no configuration subscribes to object removal => no extra HEAD
+        self.assertEqual(delete_object(["s3:ObjectCreated:*"]), 0)
+        self.assertEqual(beanstalkd.state, 'notification not sent')
+        # s3 payload contains size of deleted object
+        self.assertEqual(delete_object(["s3:ObjectRemoved:*"]), 1)
+        self.assertEqual(beanstalkd.state, 'notification sent')
+
+    def test_17_event_metadata(self):
+        self.fake_swift.register(
+            'GET', '/v1/a11/c11/o11', HTTPOk,
+            {'Content-Length': '6', 'Etag': 'abc', 'Content-Type': 'img/jpg'},
+            'passed')
+        self.fake_swift.register('DELETE', '/v1/a11/c11/o11',
+                                 HTTPOk, {}, 'passed')
+
+        def get_event(method):
+            req = Request.blank('/v1/a11/c11/o11',
+                                environ={'REQUEST_METHOD': method})
+            event = EventContext(self.fake_swift, req)
+            event.set_response(req.get_response(self.fake_swift))
+            return event
+
+        with patch('enoss.event.get_object_info') as get_object_info:
+            # metadata of read object is taken from response headers
+            event = get_event('GET')
+            self.assertEqual(event.get_size(), 6)
+            self.assertEqual(event.get_etag(), 'abc')
+            self.assertEqual(event.get_content_type(), 'img/jpg')
+            self.assertFalse(get_object_info.called)
+
+        object_info = {'status': 200, 'length': '3', 'etag': 'def',
+                       'type': 'text/plain'}
+        with patch('enoss.event.get_object_info',
+                   return_value=object_info) as get_object_info:
+            event = get_event('DELETE')
+            self.assertEqual(event.get_size(), 3)
+            self.assertEqual(event.get_etag(), 'def')
+            self.assertEqual(event.get_content_type(), 'text/plain')
+            # all metadata is read from single object info lookup
+            self.assertEqual(get_object_info.call_count, 1)
+
+    def test_18_shared_payload(self):
+        self.test_1_init()
+        self.fake_swift.register('GET', '/v1/a12/c12/o12.jpg',
+                                 HTTPOk, {}, 'passed')
+        beanstalkd = self.app.destination_handlers["BeanstalkdDestination"]
+        beanstalkd.reset()
+        beanstalkd_conf = self.s3_notification_conf["BeanstalkdConfigrations"]
+        # payload depends on configuration id only
+        beanstalkd_conf.append(dict(beanstalkd_conf[0], Events=[
+            "s3:ObjectAccessed:*"]))
+        beanstalkd_conf.append(dict(beanstalkd_conf[0], Id="test2"))
+
+        infocache = {
+            'account/a12': {'sysmeta': {}},
+            'container/a12/c12': {
+                'sysmeta': {
+                    'notifications': json.dumps(self.s3_notification_conf)
+                }
+            }
+        }
+        req = Request.blank('/v1/a12/c12/o12.jpg', environ={
+            'REQUEST_METHOD': 'GET', 'swift.infocache': infocache})
+        with patch.object(S3Payload, 'create_payload',
+                          wraps=self.app.payload_handlers['S3Payload']
+                          .create_payload) as create_payload:
+            self.assertEqual(req.get_response(self.app).status_int, 200)
+            self.assertEqual(create_payload.call_count, 2)
+        # configurations with the same id got the same encoded payload
+        self.assertEqual(len(beanstalkd.notifications), 3)
+        self.assertIsInstance(beanstalkd.notifications[0], bytes)
+        self.assertIs(beanstalkd.notifications[0],
+                      beanstalkd.notifications[1])
+        payload = json.loads(beanstalkd.notifications[0])
+        self.assertEqual(payload["Records"][0]["s3"]["object"]["key"],
+                         "o12.jpg")
+        self.assertEqual(payload["Records"][0]["s3"]["configurationId"],
+                         "test")
+        payload = json.loads(beanstalkd.notifications[2])
+        self.assertEqual(payload["Records"][0]["s3"]["configurationId"],
+                         "test2")
+
+        # payloads of handlers without own cache key are not shared
+        class ConfigurationPayload(IPayload):
+            def create_test_payload(self, event, invoking_configuration):
+                return {}
+
+            def create_payload(self, event, invoking_configuration):
+                return {"id": invoking_configuration.id}
+
+        payload_handler = ConfigurationPayload({})
+        first, second = self.app.get_compiled_configuration(json.dumps(
+            self.s3_notification_conf)).destinations_configurations[
+                "beanstalkd"][:2]
+        self.assertNotEqual(payload_handler.get_cache_key(first),
+                            payload_handler.get_cache_key(second))
+
+    def test_19_serializers(self):
+        import enoss.serializers as serializers
+        from enoss.serializers.iserializer import ISerializer
+
+        payload = {"Records": [{"eventName": "s3:ObjectCreated:Put",
+                                "s3": {"object": {"size": 5}}}]}
+        for name in serializers.__all__:
+            serializer_cls = serializers.__dict__[name]
+            self.assertTrue(issubclass(serializer_cls, ISerializer))
+            encoded = serializer_cls({}).dumps(payload)
+            self.assertIsInstance(encoded, bytes)
+            if name != 'MsgpackSerializer':
+                self.assertEqual(json.loads(encoded), payload)
+
+        self.assertIsInstance(
+            self.app.destination_serializers["BeanstalkdDestination"],
+            serializers.JsonSerializer)
+        with open('/tmp/enoss-destinations.conf', 'w') as f:
+            f.write('[beanstalkd]\nserializer = unknown\n')
+        try:
+            self.assertRaises(Exception, self._create_app)
+        finally:
+            open('/tmp/enoss-destinations.conf', 'w').close()
+
+        # destination storing JSON documents rejects other formats
+        from enoss.destinations.beanstalkd import BeanstalkdDestination
+        from enoss.destinations.elasticsearch import \
+            ElasticsearchDestination
+        self.assertTrue(ElasticsearchDestination.requires_json)
+        self.assertFalse(BeanstalkdDestination.requires_json)
+        self.assertTrue(serializers.JsonSerializer.is_json)
+        with patch.object(MockDestination, 'requires_json', True), \
+                patch.object(serializers.JsonSerializer, 'is_json', False):
+            self.assertRaises(Exception, self._create_app)
+        if 'MsgpackSerializer' in serializers.__all__:
+            self.assertFalse(serializers.MsgpackSerializer.is_json)
+
+    def test_20_s3_payload_template(self):
+        self.test_1_init()
+        self.fake_swift.register('PUT', '/v1/a13/c13/o13', HTTPOk,
+                                 {'Etag': 'abc'}, 'passed')
+        s3_conf = self.app.get_compiled_configuration(
+            json.dumps(self.s3_notification_conf))
+        dest_conf = s3_conf.destinations_configurations["beanstalkd"][0]
+        # static part of payload is compiled together with configuration
+        self.assertEqual(dest_conf.payload_template.s3["configurationId"],
+                         "test")
+
+        req = Request.blank('/v1/a13/c13/o13', environ={
+            'REQUEST_METHOD': 'PUT', 'CONTENT_LENGTH': '5'})
+        event = EventContext(self.fake_swift, req)
+        # timestamp assigned by proxy while handling request
+        req.environ['HTTP_X_TIMESTAMP'] = '1649772288.14729'
+        event.set_response(req.get_response(self.fake_swift))
+        payload = self.app.payload_handlers['S3Payload'].create_payload(
+            event, dest_conf)
+        record = payload["Records"][0]
+        self.assertEqual(record["eventVersion"], "2.2")
+        self.assertEqual(record["eventName"], "s3:ObjectCreated:Put")
+        # event time is taken from request timestamp
+        self.assertEqual(record["eventTime"], "2022-04-12T14:04:48.147290")
+        self.assertEqual(record["s3"]["bucket"]["arn"], "arn:aws:s3:::c13")
+        self.assertEqual(record["s3"]["object"], {
+            "key": "o13", "size": 5, "eTag": "abc", "versionId": "",
+            "sequencer": "1649772288.14729"})
+        # template is not modified by created payloads
+        self.assertNotIn("bucket", dest_conf.payload_template.s3)
+
+        # configuration independent part is created once per event
+        class OtherConfiguration(object):
+            id = "other"
+            payload_template = None
+
+        payload_handler = self.app.payload_handlers['S3Payload']
+        with patch.object(payload_handler, '_create_event_record',
+                          wraps=payload_handler._create_event_record) \
+                as create_event_record:
+            event.payloads.clear()
+            first = payload_handler.create_payload(event, dest_conf)
+            second = payload_handler.create_payload(
+                event, OtherConfiguration())
+        self.assertEqual(create_event_record.call_count, 1)
+        self.assertEqual(first["Records"][0]["s3"]["configurationId"],
+                         "test")
+        self.assertEqual(second["Records"][0]["s3"]["configurationId"],
+                         "other")
+        self.assertEqual(first["Records"][0]["s3"]["object"],
+                         second["Records"][0]["s3"]["object"])
+
+        # timestamps sent by client or read from responses are not used
+        self.fake_swift.register('GET', '/v1/a13/c13/o13', HTTPOk,
+                                 {'X-Timestamp': '1649772288.14729'}, 'x')
+        for method, headers in [('PUT', {'X-Timestamp': '1649772288.14729'}),
+                                ('GET', {})]:
+            req = Request.blank('/v1/a13/c13/o13', method=method,
+                                headers=headers)
+            with patch('enoss.event.Timestamp.now',
+                       return_value=Timestamp(1700000000)):
+                event = EventContext(self.fake_swift, req)
+            event.set_response(req.get_response(self.fake_swift))
+            self.assertEqual(event.get_timestamp(), Timestamp(1700000000))
+
+    @patch('enoss.destinations.elasticsearch.Elasticsearch')
+    def test_21_elasticsearch_bulk(self, es_client):
+        from enoss.destinations.elasticsearch import ElasticsearchDestination
+
+        es = es_client.return_value
+        es.bulk.return_value = {"errors": True, "items": [
+            {"index": {"status": 201}},
+            {"index": {"status": 429, "error": "rejected"}},
+            {"index": {"status": 400, "error": "mapper_parsing_exception"}}
+        ]}
+        conf = {"elasticsearch": {
+            "index": "swift_events", "hosts": "http://127.0.0.1:9200",
+            "ca_certs": "", "auth_user": "", "auth_passwd": "",
+            "bulk": "true", "bulk_max_docs": "3", "bulk_max_retries": "1"}}
+        destination = ElasticsearchDestination(conf, logger=self.logger)
+        delivered = []
+        failed = []
+        destination.set_delivery_callbacks(
+            delivered.append,
+            lambda notification, error: failed.append(notification))
+        self.assertTrue(destination.buffered)
+
+        destination.send_notification(b'{"n":1}', None)
+        destination.send_notification(b'{"n":2}', None)
+        self.assertFalse(es.bulk.called)
+        self.assertFalse(es.index.called)
+        # batch is full => flusher is woken up, request does not wait
+        destination.send_notification(b'{"n":3}', None)
+        self.assertFalse(es.bulk.called)
+        self.assertTrue(destination._flush_needed.ready())
+        destination._flusher.kill()
+        self.assertTrue(destination.flush())
+        es.bulk.assert_called_once_with(index="swift_events", operations=[
+            b'{"index":{}}', b'{"n":1}', b'{"index":{}}', b'{"n":2}',
+            b'{"index":{}}', b'{"n":3}'])
+        # only rejected document is retried
+        self.assertEqual(list(destination.buffer), [(b'{"n":2}', 1)])
+        self.assertEqual(destination.failed, 1)
+        self.assertEqual(delivered, [1])
+        self.assertEqual(failed, [b'{"n":3}'])
+
+        es.bulk.side_effect = Exception("connection refused")
+        self.assertFalse(destination.flush())
+        # retries are exhausted
+        self.assertEqual(list(destination.buffer), [])
+        self.assertEqual(destination.failed, 2)
+        self.assertEqual(failed, [b'{"n":3}', b'{"n":2}'])
+
+        # re-queued document is the oldest one when buffer is full
+        destination.bulk_buffer_size = 2
+        destination.buffer.extend([(b'{"n":4}', 0), (b'{"n":5}', 0)])
+        destination._buffer(b'{"n":3}', 1, front=True)
+        self.assertEqual(list(destination.buffer),
+                         [(b'{"n":4}', 0), (b'{"n":5}', 0)])
+        self.assertEqual(failed[-1], b'{"n":3}')
+        self.assertEqual(destination.dropped, 1)
+
+        # flusher survives unexpected errors
+        destination.bulk_flush_interval = 0
+        with patch.object(destination, 'flush',
+                          side_effect=[ValueError("bug"), False]) as flush, \
+                patch.object(destination, '_wait_for_flush',
+                             side_effect=[None, None, StopIteration]):
+            self.assertRaises(StopIteration, destination._flush_periodically)
+        self.assertEqual(flush.call_count, 2)
+
+        # documents which can not be sent on shutdown are handed over
+        destination.close()
+        self.assertEqual(list(destination.buffer), [])
+        self.assertEqual(sorted(failed[-2:]), [b'{"n":4}', b'{"n":5}'])
+
+        # batch interrupted by timeout stays in buffer
+        documents = [(b'{"n":%d}' % n, 0) for n in range(5)]
+        destination.buffer.extend(documents)
+        destination.buffer_bytes = 35
+        es.bulk.side_effect = lambda **kwargs: eventlet.sleep(1)
+        with eventlet.Timeout(0.01):
+            self.assertRaises(eventlet.Timeout, destination.flush)
+        self.assertEqual(list(destination.buffer), documents)
+        self.assertEqual(destination.buffer_bytes, 35)
+        destination.buffer.clear()
+        destination.buffer_bytes = 0
+
+        # results of bulk requests reach metrics, breaker and spool
+        destination.bulk_buffer_size = 10000
+        es.bulk.side_effect = None
+        self.app.destination_handlers["ElasticsearchDestination"] = \
+            destination
+        breaker = CircuitBreaker("ElasticsearchDestination")
+        self.app.circuit_breakers["ElasticsearchDestination"] = breaker
+        destination.set_delivery_callbacks(
+            functools.partial(self.app._on_buffered_delivered,
+                              "ElasticsearchDestination"),
+            functools.partial(self.app._on_buffered_failed,
+                              "ElasticsearchDestination"))
+        for n in range(3):
+            self.app._deliver("ElasticsearchDestination", b'{"n":%d}' % n,
+                              None)
+        destination.flush()
+        counters = self.app.metrics.counters
+        self.assertEqual(counters["destination.elasticsearch.success"], 1)
+        self.assertEqual(counters["destination.elasticsearch.failure"], 1)
+        # invalid document is dropped, rejected one is retried
+        self.assertEqual(counters["destination.elasticsearch.dropped"], 1)
+        self.assertEqual(len(breaker.calls), 2)
+
+    @patch('enoss.destinations.kafka.KafkaProducer')
+    def test_22_kafka_producer(self, kafka_producer):
+        from enoss.destinations.kafka import KafkaDestination
+
+        conf = {"kafka": {
+            "topic": "swift", "conn_bootstrap_servers": "kafka:9092",
+            "partition_key": "container", "compression_type": "gzip",
+            "linger_ms": "5", "batch_size": "32768", "acks": "all",
+            "enable_idempotence": "true"}}
+        destination = KafkaDestination(conf, logger=self.logger)
+        kafka_producer.assert_called_once_with(
+            bootstrap_servers="kafka:9092", compression_type="gzip",
+            linger_ms=5, batch_size=32768, acks="all",
+            enable_idempotence=True)
+
+        req = Request.blank('/v1/a14/c14/o14')
+        event = EventContext(self.fake_swift, req)
+        destination.send_notification(b'{}', event)
+        producer = kafka_producer.return_value
+        producer.send.assert_called_once_with("swift", b'{}',
+                                              key=b"a14/c14")
+        self.assertTrue(destination.buffered)
+
+        # results of sent messages reach metrics and spool
+        from kafka.errors import KafkaTimeoutError
+
+        spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool_dir)
+        self.app = self._create_app(spool_dir=spool_dir)
+        self.app.destination_handlers["KafkaDestination"] = destination
+        self.app.spools["KafkaDestination"] = Spool(
+            os.path.join(spool_dir, "KafkaDestination"))
+        destination.set_delivery_callbacks(
+            functools.partial(self.app._on_buffered_delivered,
+                              "KafkaDestination"),
+            functools.partial(self.app._on_buffered_failed,
+                              "KafkaDestination"))
+        producer.send.reset_mock()
+        for notification in [b'{"n":1}', b'{"n":2}']:
+            self.app._deliver("KafkaDestination", notification, event)
+        counters = self.app.metrics.counters
+        # message is not delivered when send() returns
+        self.assertNotIn("destination.kafka.success", counters)
+        future = producer.send.return_value
+        callback = future.add_callback.call_args_list[0][0][0]
+        errback = future.add_errback.call_args_list[1][0][0]
+        callback(None)
+        errback(KafkaTimeoutError("broker not available"))
+        self.assertEqual(counters["destination.kafka.success"], 1)
+        self.assertEqual(counters["destination.kafka.failure"], 1)
+        self.assertEqual(counters["destination.kafka.spooled"], 1)
+        self.assertIn("broker not available",
+                      self.logger.get_lines_for_level('error')[-1])
+        spooled = []
+        self.app.spools["KafkaDestination"].replay(spooled.append)
+        self.assertEqual(spooled, [b'{"n":2}'])
+
+        conf["kafka"]["partition_key"] = "invalid"
+        self.assertRaises(ValueError, KafkaDestination, conf)
+
+    @patch('enoss.destinations.beanstalkd.eventlet.sleep')
+    @patch('enoss.destinations.beanstalkd.Client')
+    def test_23_beanstalkd_pool(self, client, sleep):
+        from enoss.destinations.beanstalkd import BeanstalkdDestination
+
+        conf = {"beanstalkd": {"addr": "127.0.0.1", "port": "11300",
+                               "tube": "enoss", "pool_size": "2"}}
+        destination = BeanstalkdDestination(conf, logger=self.logger)
+        # connections are created on demand
+        self.assertFalse(client.called)
+
+        connection = client.return_value
+        destination.send_notification(b'{}', None)
+        destination.send_notification(b'{}', None)
+        # idle connection is reused
+        self.assertEqual(client.call_count, 1)
+        connection.use.assert_called_once_with("enoss")
+        self.assertEqual(connection.put.call_count, 2)
+
+        # connection breaks => reconnect with backoff
+        connection.put.side_effect = [ConnectionResetError(), None]
+        destination.send_notification(b'{}', None)
+        self.assertEqual(client.call_count, 2)
+        self.assertTrue(connection.close.called)
+        sleep.assert_called_once_with(0.1)
+        self.assertEqual(len(destination.pool.free), 1)
+
+        connection.put.side_effect = ConnectionResetError()
+        self.assertRaises(ConnectionResetError,
+                          destination.send_notification, b'{}', None)
+        self.assertEqual(sleep.call_count, 4)
+        # all connections were returned to the pool
+        self.assertEqual(destination.pool.semaphore.balance, 2)
+
+    @patch('enoss.destinations.beanstalkd.Client')
+    def test_24_beanstalkd_pipelined_puts(self, client):
+        from io import BytesIO
+        from enoss.destinations.beanstalkd import BeanstalkdDestination
+
+        conf = {"beanstalkd": {"addr": "127.0.0.1", "port": "11300"}}
+        destination = BeanstalkdDestination(conf, logger=self.logger)
+        connection = client.return_value
+        connection._reader = BytesIO(b"INSERTED 1\r\nJOB_TOO_BIG\r\n"
+                                     b"INSERTED 3\r\n")
+        errors = destination.send_notifications(
+            [(b'{"a":1}', None), (b'{"b":2}', None), (b'{}', None)])
+        # all puts are written at once
+        connection._sock.sendall.assert_called_once_with(
+            b'put 65536 0 60 7\r\n{"a":1}\r\n'
+            b'put 65536 0 60 7\r\n{"b":2}\r\n'
+            b'put 65536 0 60 2\r\n{}\r\n')
+        self.assertFalse(connection.put.called)
+        self.assertIsNone(errors[0])
+        self.assertIsNotNone(errors[1])
+        self.assertIsNone(errors[2])
+        self.assertEqual(len(destination.pool.free), 1)
+
+        # broken connection => whole batch failed
+        connection._sock.sendall.side_effect = ConnectionResetError()
+        errors = destination.send_notifications([(b'{}', None)] * 2)
+        self.assertEqual(len(errors), 2)
+        self.assertIsInstance(errors[0], ConnectionResetError)
+        self.assertEqual(len(destination.pool.free), 0)
+        self.assertEqual(destination.pool.semaphore.balance, 8)
+
+        # dispatcher takes queued notifications as batch
+        batches = []
+        dispatcher = NotificationDispatcher(
+            lambda name, notifications: batches.append(
+                (name, len(notifications))), workers=1, batch_size=3)
+        for _ in range(4):
+            dispatcher.put("A", b'{}', None)
+        dispatcher.put("B", b'{}', None)
+        eventlet.sleep(0)
+        eventlet.sleep(0)
+        self.assertEqual(sorted(batches), [("A", 1), ("A", 3), ("B", 1)])
+
+    def test_25_spool(self):
+        spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool_dir)
+
+        spool = Spool(os.path.join(spool_dir, "d"), segment_size=20)
+        for i in range(4):
+            spool.append(b'{"n":%d}' % i)
+        # segment is rotated once it reaches segment_size
+        self.assertEqual(len(spool.segments()), 2)
+
+        sent = []
+
+        def send(notification):
+            if len(sent) == 1:
+                sent.append(None)
+                raise Exception("destination unavailable")
+            sent.append(notification)
+
+        self.assertRaises(Exception, spool.replay, send)
+        sent.remove(None)
+        spool.replay(sent.append)
+        # nothing is lost nor sent twice
+        self.assertEqual(sent, [b'{"n":0}', b'{"n":1}', b'{"n":2}',
+                                b'{"n":3}'])
+        self.assertEqual(spool.segments(), [])
+        self.assertEqual(spool.size(), 0)
+
+        # incomplete record is skipped
+        spool.append(b'{}')
+        spool._file.write(b'\x00\x00\x00\x09{')
+        spool._file.flush()
+        sent = []
+        spool.replay(sent.append)
+        self.assertEqual(sent, [b'{}'])
+
+        # undeliverable notification is spooled and replayed later
+        self.app = self._create_app(spool_dir=spool_dir)
+        self.fake_swift.register('GET', '/v1/a5/c5/o5.jpg',
+                                 HTTPOk, {}, 'passed')
+        beanstalkd = self.app.destination_handlers["BeanstalkdDestination"]
+        beanstalkd.reset()
+        infocache = {
+            'account/a5': {'sysmeta': {}},
+            'container/a5/c5': {
+                'sysmeta': {
+                    'notifications': json.dumps(self.s3_notification_conf)
+                }
+            }
+        }
+        beanstalkd_spool = self.app.spools["BeanstalkdDestination"]
+        for error in [Exception("too big"), ConnectionRefusedError()]:
+            with patch.object(beanstalkd, 'send_notification',
+                              side_effect=error):
+                req = Request.blank(
+                    '/v1/a5/c5/o5.jpg',
+                    environ={'REQUEST_METHOD': 'GET',
+                             'swift.infocache': infocache})
+                self.assertEqual(req.get_response(self.app).status_int, 200)
+        self.assertEqual(beanstalkd.notifications, [])
+        # only notification which failed with retryable error is spooled
+        self.assertEqual(len(beanstalkd_spool.segments()), 1)
+        self.assertEqual(self.app.metrics.counters[
+            "destination.beanstalkd.dropped"], 1)
+
+        # notification which can not be sent does not block the spool
+        beanstalkd_spool.append(b'{}')
+        self.app.spool_replayer.rate = 0
+        with patch.object(beanstalkd, 'send_notification',
+                          side_effect=[None, Exception("too big")]):
+            self.app.spool_replayer.replay()
+        self.assertEqual(beanstalkd_spool.segments(), [])
+        self.assertEqual(self.app.metrics.counters[
+            "destination.beanstalkd.dropped"], 2)
+
+        beanstalkd_spool.append(b'{"n":1}')
+        self.app.spool_replayer.replay()
+        self.assertEqual(beanstalkd.notifications, [b'{"n":1}'])
+        self.assertEqual(os.listdir(
+            os.path.join(spool_dir, "BeanstalkdDestination")), [])
+
+        # notifications over size limit are dropped
+        spool = Spool(os.path.join(spool_dir, "full"), max_bytes=30)
+        spool.append(b'{"n":1}' * 2)
+        self.assertRaises(SpoolFull, spool.append, b'{"n":2}' * 2)
+        self.assertEqual(spool.size(), 18)
+
+        # segment removed before it was locked by writer is not used
+        spool = Spool(os.path.join(spool_dir, "race"))
+        real_flock = fcntl.flock
+
+        def flock(segment_file, operation):
+            if not removed:
+                removed.append(segment_file.name)
+                os.unlink(segment_file.name)
+            real_flock(segment_file, operation)
+
+        removed = []
+        with patch('enoss.spool.fcntl.flock', side_effect=flock):
+            spool.append(b'{}')
+        self.assertEqual(len(removed), 1)
+        self.assertEqual(len(spool.segments()), 1)
+        self.assertNotEqual(os.path.join(spool.path, spool.segments()[0]),
+                            removed[0])
+
+    @patch('enoss.breaker.time')
+    def test_26_circuit_breaker(self, time_mock):
+        time_mock.time.return_value = 1000
+        breaker = CircuitBreaker("A", failure_threshold=3, failure_rate=0.5,
+                                 window=60, min_calls=4, reset_timeout=30)
+        # consecutive failures
+        for _ in range(3):
+            self.assertTrue(breaker.allow())
+            breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.rejected, 1)
+
+        # single probe after reset timeout
+        time_mock.time.return_value = 1030
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        time_mock.time.return_value = 1060
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+
+        # failure rate in window
+        for failed in [False, True, False, True]:
+            breaker.record_failure() if failed else breaker.record_success()
+        self.assertEqual(breaker.state, "open")
+
+        # old sends are out of window
+        time_mock.time.return_value = 2000
+        breaker.allow()
+        breaker.record_success()
+        for failed in [True, False, True]:
+            breaker.record_failure() if failed else breaker.record_success()
+        time_mock.time.return_value = 2061
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "closed")
+
+        # circuit breaker is enabled per destination
+        self.assertEqual(self.app.circuit_breakers, {})
+        with open('/tmp/enoss-destinations.conf', 'w') as f:
+            f.write('[beanstalkd]\ncircuit_breaker = true\n')
+
+        # open circuit => destination is not called
+        self.app = self._create_app()
+        beanstalkd = self.app.destination_handlers["BeanstalkdDestination"]
+        breaker = self.app.circuit_breakers["BeanstalkdDestination"]
+        with patch.object(beanstalkd, 'send_notification',
+                          side_effect=Exception("unavailable")) as send:
+            for _ in range(7):
+                self.assertRaises(Exception, self.app._deliver,
+                                  "BeanstalkdDestination", b'{}', None)
+            self.assertEqual(send.call_count, 5)
+        self.assertEqual(breaker.state, "open")
+        self.assertEqual(breaker.rejected, 2)
+
+        # only own send timeout is failure of destination
+        self.app = self._create_app()
+        beanstalkd = self.app.destination_handlers["BeanstalkdDestination"]
+        breaker = self.app.circuit_breakers["BeanstalkdDestination"]
+        budget = eventlet.Timeout(5)
+        budget.cancel()
+        with patch.object(beanstalkd, 'send_notification',
+                          side_effect=budget):
+            for _ in range(7):
+                self.assertRaises(eventlet.Timeout, self.app._deliver,
+                                  "BeanstalkdDestination", b'{}', None)
+        self.assertEqual(breaker.state, "closed")
+        self.assertEqual(breaker.consecutive_failures, 0)
+        # interrupted probe does not block next one
+        breaker._open()
+        time_mock.time.return_value += 30
+        with patch.object(beanstalkd, 'send_notification',
+                          side_effect=budget):
+            self.assertRaises(eventlet.Timeout, self.app._deliver,
+                              "BeanstalkdDestination", b'{}', None)
+        self.assertTrue(breaker.allow())
+
+    def test_27_notification_budget(self):
+        budget = NotificationBudget(0.05)
+        self.assertEqual(budget.run(lambda x: x, 1), 1)
+        self.assertRaises(BudgetExceeded, budget.run, eventlet.sleep, 1)
+        self.assertLessEqual(budget.remaining, 0)
+        self.assertRaises(BudgetExceeded, budget.run, lambda: None)
+
+        def slow_send(notification, event):
+            eventlet.sleep(1)
+
+        self.app = self._create_app(notification_budget_ms='50')
+        self.fake_swift.register('GET', '/v1/a5/c5/o5.jpg',
+                                 HTTPOk, {}, 'passed')
+        beanstalkd = self.app.destination_handlers["BeanstalkdDestination"]
+        infocache = {
+            'account/a5': {'sysmeta': {}},
+            'container/a5/c5': {
+                'sysmeta': {
+                    'notifications': json.dumps(self.s3_notification_conf)
+                }
+            }
+        }
+        with patch.object(beanstalkd, 'send_notification',
+                          side_effect=slow_send):
+            req = Request.blank(
+                '/v1/a5/c5/o5.jpg',
+                environ={'REQUEST_METHOD': 'GET',
+                         'swift.infocache': infocache})
+            with eventlet.Timeout(0.5):
+                self.assertEqual(req.get_response(self.app).status_int, 200)
+        self.assertEqual(self.app.budget_exceeded, 1)
+        self.assertEqual(self.app.budget_dropped, 1)
+
+        # send timeout of destination
+        self.app.send_timeouts["BeanstalkdDestination"] = 0.01
+        with patch.object(beanstalkd, 'send_notification',
+                          side_effect=slow_send):
+            self.assertRaises(SendTimeout, self.app._deliver,
+                              "BeanstalkdDestination", b'{}', None)
+            self.app._deliver_batch("BeanstalkdDestination",
+                                    [(b'{}', None)] * 2)
+        self.assertIn("did not respond",
+                      self.logger.get_lines_for_level('error')[-1])
+
+        # notifications sent before timeout are not failed
+        sent = []
+
+        def second_slow_send(notification, event):
+            if sent:
+                eventlet.sleep(1)
+            sent.append(notification)
+
+        breaker = CircuitBreaker("BeanstalkdDestination")
+        self.app.circuit_breakers["BeanstalkdDestination"] = breaker
+        with patch.object(beanstalkd, 'send_notification',
+                          side_effect=second_slow_send), \
+                patch.object(self.app, '_on_delivery_error') as on_error, \
+                patch.object(breaker, 'record_failure') as record_failure:
+            self.app._deliver_batch("BeanstalkdDestination",
+                                    [(b'{"a":1}', None), (b'{"b":2}', None),
+                                     (b'{"c":3}', None)])
+        self.assertEqual([call[0][1] for call in on_error.call_args_list],
+                         [b'{"b":2}', b'{"c":3}'])
+        self.assertIsInstance(on_error.call_args[0][2], SendTimeout)
+        # whole batch timed out once
+        self.assertEqual(record_failure.call_count, 1)
+
+    def test_28_statsd_metrics(self):
+        self.app = self._create_app()
+        self.fake_swift.register('GET', '/v1/a5/c5/o5.jpg',
+                                 HTTPOk, {}, 'passed')
+        infocache = {
+            'account/a5': {'sysmeta': {}},
+            'container/a5/c5': {
+                'sysmeta': {
+                    'notifications': json.dumps(self.s3_notification_conf)
+                }
+            }
+        }
+        statsd = self.logger.statsd_client
+        statsd.clear()
+        for _ in range(2):
+            req = Request.blank(
+                '/v1/a5/c5/o5.jpg',
+                environ={'REQUEST_METHOD': 'GET',
+                         'swift.infocache': dict(infocache)})
+            self.assertEqual(req.get_response(self.app).status_int, 200)
+        timings = [call[0][0] for call in statsd.calls['timing']]
+        for stage in ["config_lookup", "config_compile", "evaluation",
+                      "payload", "serialization",
+                      "destination.beanstalkd.send"]:
+            self.assertIn(stage + ".timing", timings)
+        self.assertEqual(timings.count("config_compile.timing"), 1)
+        self.assertEqual(statsd.get_stats_counts()["config_cache.miss"], 1)
+        self.assertEqual(statsd.get_stats_counts()["config_cache.hit"], 1)
+        self.assertEqual(
+            statsd.get_stats_counts()["destination.beanstalkd.success"], 2)
+
+        beanstalkd = self.app.destination_handlers["BeanstalkdDestination"]
+        with patch.object(beanstalkd, 'send_notification',
+                          side_effect=Exception("unavailable")):
+            self.app._dispatch("BeanstalkdDestination", b'{}', None)
+        self.assertEqual(
+            statsd.get_stats_counts()["destination.beanstalkd.failure"], 1)
+        self.assertEqual(
+            statsd.get_stats_counts()["destination.beanstalkd.dropped"], 1)
+
+        self.app.dispatcher = NotificationDispatcher(self.app._deliver_batch)
+        self.app._dispatch("BeanstalkdDestination", b'{}', None)
+        self.assertEqual(statsd.calls['timing'][-1][0],
+                         ("dispatch.queue_depth", 1))
+        eventlet.sleep(0)
+        self.assertEqual(
+            statsd.get_stats_counts()["destination.beanstalkd.success"], 3)
+
+    def test_29_stats_endpoint(self):
+        self.app = self._create_app(stats_secret='secret',
+                                    async_dispatch='true')
+        self.fake_swift.register('GET', '/v1/a5/c5/o5.jpg',
+                                 HTTPOk, {}, 'passed')
+        infocache = {
+            'account/a5': {'sysmeta': {}},
+            'container/a5/c5': {
+                'sysmeta': {
+                    'notifications': json.dumps(self.s3_notification_conf)
+                }
+            }
+        }
+        req = Request.blank(
+            '/v1/a5/c5/o5.jpg',
+            environ={'REQUEST_METHOD': 'GET', 'swift.infocache': infocache})
+        self.assertEqual(req.get_response(self.app).status_int, 200)
+
+        req = Request.blank('/info/enoss',
+                            headers={'X-Enoss-Stats-Secret': 'wrong'})
+        self.assertEqual(req.get_response(self.app).status_int, 403)
+        req = Request.blank('/info/enoss',
+                            headers={'X-Enoss-Stats-Secret': 'secret'})
+        resp = req.get_response(self.app)
+        self.assertEqual(resp.status_int, 200)
+        stats = json.loads(resp.body)
+        self.assertEqual(stats["config_cache"]["misses"], 1)
+        self.assertEqual(stats["counters"]["evaluated"], 1)
+        self.assertEqual(
+            stats["counters"]["destination.beanstalkd.matched"], 1)
+        self.assertEqual(stats["dispatch"]["queue_depth"], 1)
+        self.assertEqual(
+            stats["breakers"]["BeanstalkdDestination"]["state"], "closed")
+        self.assertEqual(stats["histograms"]["evaluation"]["count"], 1)
+        self.assertEqual(stats["spools"], {})
+
+        # profile of the worker
+        req = Request.blank('/info/enoss?profile=0.01',
+                            headers={'X-Enoss-Stats-Secret': 'secret'})
+        stats = json.loads(req.get_response(self.app).body)
+        self.assertIn("function calls", stats["profile"])
+        self.assertEqual(stats["dispatch"]["queue_depth"], 0)
+        for duration in ['x', 'nan', '-1']:
+            req = Request.blank('/info/enoss?profile=' + duration,
+                                headers={'X-Enoss-Stats-Secret': 'secret'})
+            self.assertEqual(req.get_response(self.app).status_int, 400)
+        # only one profile runs at a time
+        self.app._profiling = True
+        req = Request.blank('/info/enoss?profile=1',
+                            headers={'X-Enoss-Stats-Secret': 'secret'})
+        self.assertEqual(req.get_response(self.app).status_int, 409)
+
+        # endpoint can not hide storage path
+        self.assertRaises(ValueError, self._create_app,
+                          stats_secret='secret', stats_path='/v1/a/c')
+
+    def test_30_key_filter_index(self):
+        # configuration per directory and file type
+        configurations = []
+        for i, prefix in enumerate(["", "logs/", "logs/2022/", "img/"]):
+            for suffix in [None, ".jpg", "2.jpg"]:
+                rules = [{"Name": "prefix", "Value": prefix}]
+                if suffix:
+                    rules.append({"Name": "suffix", "Value": suffix})
+                if i == 3:
+                    rules.append({"Name": "maxsize", "Value": 10})
+                configurations.append({
+                    "Id": "{}{}".format(prefix, suffix), "Events": ["*"],
+                    "Filter": {"Key": {"FilterRules": rules},
+                               "Other": {"FilterRules": [
+                                   {"Name": "prefix", "Value": "tmp/"},
+                                   {"Name": "prefix", "Value": "tmp/x"}]}}})
+        configurations.append({"Id": "all", "Events": ["*"]})
+        s3_conf = S3NotifiationConfiguration(
+            {"BeanstalkdConfigrations": configurations})
+        self.assertEqual(len(s3_conf.key_index.rules_count), 24)
+
+        for key in ["logs/2022/a2.jpg", "logs/a.png", "img/b.jpg",
+                    "tmp/x.jpg", "tmp/y", "other", "log"]:
+            path = '/v1/a9/c9/' + key
+            self.fake_swift.register('PUT', path, HTTPOk, {}, 'passed')
+            req = Request.blank(path, environ={'REQUEST_METHOD': 'PUT'},
+                                body=b'x' * 20)
+            event = EventContext(self.fake_swift, req)
+            event.set_response(req.get_response(self.fake_swift))
+            dest_conf_class = S3NotifiationConfiguration.\
+                DestinationConfiguration
+            with patch.object(dest_conf_class, 'does_satisfy', autospec=True,
+                              side_effect=dest_conf_class.does_satisfy) \
+                    as does_satisfy:
+                satisfied = [
+                    conf.id for conf in
+                    s3_conf.get_satisfied_destinations(event)["beanstalkd"]]
+            # same result as evaluating rules one by one
+            expected = [conf.id for conf in
+                        s3_conf.destinations_configurations["beanstalkd"]
+                        if conf.does_satisfy(event)]
+            self.assertEqual(satisfied, expected)
+            if key == "logs/2022/a2.jpg":
+                self.assertEqual(satisfied, [
+                    "None", ".jpg", "2.jpg", "logs/None", "logs/.jpg",
+                    "logs/2.jpg", "logs/2022/None", "logs/2022/.jpg",
+                    "logs/2022/2.jpg", "all"])
+            if key == "img/b.jpg":
+                # size rule is checked after index
+                self.assertNotIn("img/.jpg", satisfied)
+            if key == "tmp/x.jpg":
+                self.assertEqual(len(satisfied), 13)
+            if key == "other":
+                # configurations without matched filter are not evaluated
+                self.assertEqual(satisfied, ["None", "all"])
+                self.assertEqual(does_satisfy.call_count, 2)
+
+    def test_31_compiled_rules(self):
+        size_rules = [{"Name": "maxsize", "Value": 100},
+                      {"Name": "suffix", "Value": ".jpg"}]
+        configurations = [
+            {"Id": str(i), "Events": ["*"],
+             "Filter": {"Key": {"FilterRules": size_rules + [
+                 {"Name": "usersin", "Value": ["u{}".format(i)]}]}}}
+            for i in range(3)]
+        s3_conf = S3NotifiationConfiguration(
+            {"BeanstalkdConfigrations": configurations})
+        filters = [conf.filters[0] for conf
+                   in s3_conf.destinations_configurations["beanstalkd"]]
+        # identical rules are shared
+        self.assertIs(filters[0].rules[0], filters[2].rules[0])
+        self.assertIsNot(filters[0].rules[2], filters[2].rules[2])
+        self.assertEqual(len(s3_conf.interned_rules), 5)
+
+        self.fake_swift.register('PUT', '/v1/a/c/o.jpg', HTTPOk, {}, '')
+        req = Request.blank('/v1/a/c/o.jpg', environ={
+            'REQUEST_METHOD': 'PUT', 'REMOTE_USER': 'u1'}, body=b'x' * 10)
+        event = EventContext(self.fake_swift, req)
+        event.set_response(req.get_response(self.fake_swift))
+        satisfied = s3_conf.get_satisfied_destinations(event)
+        self.assertEqual([conf.id for conf in satisfied["beanstalkd"]],
+                         ["1"])
+        stats = {(rule["rule"], rule["value"]): rule
+                 for rule in s3_conf.get_rule_stats()}
+        # size rule is expensive => evaluated after users rule, only for
+        # configuration whose user matched
+        self.assertEqual(stats[("MaxsizeRule", "100")]["evaluations"], 1)
+        self.assertEqual(stats[("UsersinRule", '["u0"]')]["evaluations"], 1)
+        self.assertEqual(stats[("UsersinRule", '["u1"]')]["matches"], 1)
+        # indexed rules have no evaluations to report
+        self.assertIn(("SuffixRule", '".jpg"'), s3_conf.interned_rules)
+        self.assertNotIn(("SuffixRule", '".jpg"'), stats)
+
+        # result of shared rule is computed once per event
+        req = Request.blank('/v1/a/c/o.jpg', environ={
+            'REQUEST_METHOD': 'PUT', 'REMOTE_USER': 'u1'}, body=b'x' * 10)
+        configurations[0]["Filter"]["Key"]["FilterRules"] = size_rules
+        configurations[1]["Filter"]["Key"]["FilterRules"] = size_rules
+        s3_conf = S3NotifiationConfiguration(
+            {"BeanstalkdConfigrations": configurations})
+        event = EventContext(self.fake_swift, req)
+        event.set_response(req.get_response(self.fake_swift))
+        with patch.object(EventContext, 'get_size',
+                          return_value=10) as get_size:
+            satisfied = s3_conf.get_satisfied_destinations(event)
+        self.assertEqual([conf.id for conf in satisfied["beanstalkd"]],
+                         ["0", "1"])
+        self.assertEqual(get_size.call_count, 1)
+
+        # also by configurations of different levels (e.g. admin and
+        # container)
+        other_level_conf = S3NotifiationConfiguration(
+            {"BeanstalkdConfigrations": configurations[:1]})
+        with patch.object(EventContext, 'get_size',
+                          return_value=10) as get_size:
+            other_level_conf.get_satisfied_destinations(event)
+        self.assertFalse(get_size.called)
+
+    def test_32_httpcodes_rule(self):
+        rule_handler = filter_rule_handlers["HttpcodesRule"]
+        self.assertTrue(rule_handler.validate(["200", "4xx", "500-599",
+                                               "!404", "!5x3"]))
+        for invalid in ["20a", "599-500", "", "!", "5-", 404, "0-5",
+                        "0-20000000", "!900-1000", "99", "1000", "x",
+                        "xxxx", "!99"]:
+            self.assertFalse(rule_handler.validate([invalid]))
+        self.assertFalse(rule_handler.validate("200"))
+
+        class Event(object):
+            status = None
+
+        def matches(value, status):
+            event = Event()
+            event.status = status
+            return rule_handler(value)(event)
+
+        self.assertTrue(matches(["200"], 200))
+        self.assertFalse(matches(["200"], 201))
+        self.assertTrue(matches(["4xx"], 404))
+        self.assertFalse(matches(["4xx"], 500))
+        self.assertTrue(matches(["500-502"], 502))
+        self.assertFalse(matches(["500-502"], 503))
+        self.assertFalse(matches(["4xx", "!404"], 404))
+        self.assertTrue(matches(["4xx", "!404"], 403))
+        # only negations => any other status
+        self.assertTrue(matches(["!2xx"], 503))
+        self.assertFalse(matches(["!2xx"], 201))
+        self.assertFalse(matches(["5xx"], None))
+        self.assertEqual(len(rule_handler(["1xx", "!100-199"]).codes), 0)
+        # out of bounds ranges are clamped to status codes
+        self.assertEqual(len(rule_handler(["0-20000000"]).codes), 900)
+
 
 if __name__ == '__main__':
     unittest.main()